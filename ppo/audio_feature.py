@@ -1,7 +1,11 @@
 from bidict import bidict
 
+from ppo.slotted import Slotted
 
-class AudioFeature:
+
+class AudioFeature(Slotted):
+    __slots__ = ('danceability', 'energy', 'loudness', 'speechiness', 'acousticness', 'instrumentalness', 'liveness',
+                 'valence', 'tempo', 'tonality')
     feature_labels = bidict({l: i for i, l in enumerate(
         ['danceability', 'energy', 'loudness', 'speechiness', 'acousticness', 'instrumentalness', 'liveness', 'valence',
          'tempo', 'tonality'])})
@@ -20,6 +24,11 @@ class AudioFeature:
         self.tempo = tempo
         self.tonality = mode, key
 
+    @property
+    def tonality_code(self):
+        mode, key = self.tonality
+        return 12 * mode + key
+
     def __iter__(self):
         yield self.danceability
         yield self.energy
@@ -0,0 +1,70 @@
+from collections.abc import Mapping
+
+import numpy as np
+
+from ppo.audio_feature import AudioFeature
+
+
+class FeatureMatrix(Mapping):
+    labels = [label for label in AudioFeature.feature_labels if label != 'tonality']
+
+    def __init__(self, data, tonality):
+        self.data = data
+        self.tonality = tonality
+
+    @classmethod
+    def from_dict(cls, features: Mapping[int, AudioFeature], n_tracks=None, dtype=np.float32):
+        track_ids = np.fromiter(features.keys(), dtype=np.int64, count=len(features))
+        data = np.array([[feature[label] for label in cls.labels] for feature in features.values()],
+                        dtype=dtype).reshape(-1, len(cls.labels))
+        tonality = np.array([f.tonality_code for f in features.values()], dtype=np.int8)
+        return cls.from_arrays(track_ids, data, tonality, n_tracks, dtype)
+
+    @classmethod
+    def from_arrays(cls, track_ids, data, tonality, n_tracks=None, dtype=np.float32):
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        if n_tracks is None:
+            n_tracks = int(track_ids.max(initial=-1)) + 1
+        _, last = np.unique(track_ids[::-1], return_index=True)
+        keep = len(track_ids) - 1 - last
+
+        matrix = cls(np.full((n_tracks, len(cls.labels)), np.nan, dtype=dtype),
+                     np.full(n_tracks, -1, dtype=np.int8))
+        matrix.data[track_ids[keep]] = data[keep]
+        matrix.tonality[track_ids[keep]] = tonality[keep]
+        return matrix
+
+    @classmethod
+    def lookup(cls, features: 'FeatureMatrix | Mapping[int, AudioFeature]', track_ids):
+        if isinstance(features, FeatureMatrix):
+            return features.get_many(track_ids)
+        return cls.from_dict({track_id: features[track_id] for track_id in track_ids
+                              if track_id in features}).get_many(track_ids)
+
+    def column(self, label):
+        return self.data[:, self.labels.index(label)]
+
+    def get_many(self, track_ids):
+        track_ids = np.asarray(track_ids, dtype=np.int64)
+        valid = (track_ids >= 0) & (track_ids < len(self.tonality))
+        track_ids = np.where(valid, track_ids, 0)
+        present = valid & (self.tonality[track_ids] >= 0)
+        data = self.data[track_ids]
+        data[~present] = np.nan
+        return data, np.where(present, self.tonality[track_ids], -1).astype(np.int8), present
+
+    def __getitem__(self, track_id):
+        if track_id not in self:
+            raise KeyError(track_id)
+        mode, key = divmod(int(self.tonality[track_id]), 12)
+        return AudioFeature(*self.data[track_id].tolist(), mode, key)
+
+    def __contains__(self, track_id):
+        return isinstance(track_id, (int, np.integer)) and 0 <= track_id < len(self.tonality) and \
+            self.tonality[track_id] >= 0
+
+    def __iter__(self):
+        return iter(np.flatnonzero(self.tonality >= 0).tolist())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.tonality >= 0))
@@ -1,8 +1,12 @@
-from typeguard import typechecked
+from ppo.slotted import Slotted
 from ppo.track import Track
+from utils.typecheck_util import typechecked
 
 
-class Playlist:
+class Playlist(Slotted):
+    __slots__ = ('playlist_id', 'title', 'nb_tracks', 'nb_favorites', 'is_collaborative', 'modified_at', 'tracks',
+                 '_tracks')
+
     @typechecked
     def __init__(self,
                  playlist_id: int,
@@ -40,6 +44,8 @@ class Playlist:
 
 
 class PlaylistTest(Playlist):
+    __slots__ = ('hidden',)
+
     def __init__(self, playlist: Playlist,
                  tracks: list[Track],
                  hidden: list[Track]):
@@ -0,0 +1,146 @@
+from array import array
+from collections.abc import Mapping, ValuesView, ItemsView, Callable
+
+import numpy as np
+
+from ppo.playlist import Playlist
+from ppo.track import Track
+
+
+class PlaylistStore:
+    def __init__(self, pid, titles, nb_tracks, nb_favorites, is_collaborative, modified_at, mask,
+                 offsets, track_idx):
+        self.pid = pid
+        self.titles = titles
+        self.nb_tracks = nb_tracks
+        self.nb_favorites = nb_favorites
+        self.is_collaborative = is_collaborative
+        self.modified_at = modified_at
+        self.mask = mask
+        self.offsets = offsets
+        self.track_idx = track_idx
+        self._rows = None
+
+    def __len__(self):
+        return len(self.pid)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_rows'] = None
+        return state
+
+    @property
+    def rows(self):
+        if self._rows is None:
+            self._rows = np.full(int(self.pid.max(initial=-1)) + 1, -1, dtype=np.int32)
+            self._rows[self.pid] = np.arange(len(self.pid), dtype=np.int32)
+        return self._rows
+
+    def row(self, pid):
+        if not 0 <= pid < len(self.rows) or self.rows[pid] < 0:
+            raise KeyError(pid)
+        return int(self.rows[pid])
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    def entry_rows(self):
+        return np.repeat(np.arange(len(self), dtype=np.int32), self.lengths())
+
+    def segment_sum(self, values):
+        return np.bincount(self.entry_rows(), weights=values, minlength=len(self))
+
+    def track_indices(self, row):
+        return self.track_idx[self.offsets[row]:self.offsets[row + 1]]
+
+    def playlist(self, row, track: Callable[[int], Track]):
+        return Playlist(int(self.pid[row]), self.titles[row], int(self.nb_tracks[row]), int(self.nb_favorites[row]),
+                        bool(self.is_collaborative[row]), int(self.modified_at[row]),
+                        [track(idx) for idx in self.track_indices(row).tolist()])
+
+    def subset(self, rows):
+        lengths = self.lengths()[rows]
+        offsets = np.zeros(len(rows) + 1, dtype=np.int32)
+        np.cumsum(lengths, out=offsets[1:])
+        track_idx = np.concatenate([self.track_indices(row) for row in rows]) if len(rows) else self.track_idx[:0]
+        return PlaylistStore(self.pid[rows], [self.titles[row] for row in rows], self.nb_tracks[rows],
+                             self.nb_favorites[rows], self.is_collaborative[rows], self.modified_at[rows],
+                             self.mask[rows], offsets, track_idx.astype(np.int32))
+
+
+class PlaylistStoreBuilder:
+    def __init__(self):
+        self.pid = array('i')
+        self.titles = []
+        self.nb_tracks = array('i')
+        self.nb_favorites = array('i')
+        self.is_collaborative = array('b')
+        self.modified_at = array('q')
+        self.mask = array('b')
+        self.offsets = array('i', [0])
+        self.track_idx = array('i')
+
+    def __len__(self):
+        return len(self.pid)
+
+    def append(self, pid, title, nb_tracks, nb_favorites, is_collaborative, modified_at, mask, track_idx):
+        self.pid.append(pid)
+        self.titles.append(title)
+        self.nb_tracks.append(nb_tracks)
+        self.nb_favorites.append(nb_favorites)
+        self.is_collaborative.append(is_collaborative)
+        self.modified_at.append(modified_at)
+        self.mask.append(mask)
+        self.track_idx.extend(track_idx)
+        self.offsets.append(len(self.track_idx))
+
+    def build(self):
+        return PlaylistStore(np.frombuffer(self.pid, dtype=np.int32).copy(),
+                             self.titles,
+                             np.frombuffer(self.nb_tracks, dtype=np.int32).copy(),
+                             np.frombuffer(self.nb_favorites, dtype=np.int32).copy(),
+                             np.frombuffer(self.is_collaborative, dtype=np.int8).astype(bool),
+                             np.frombuffer(self.modified_at, dtype=np.int64).copy(),
+                             np.frombuffer(self.mask, dtype=np.int8).astype(bool),
+                             np.frombuffer(self.offsets, dtype=np.int32).copy(),
+                             np.frombuffer(self.track_idx, dtype=np.int32).copy())
+
+
+class PlaylistMapping(Mapping):
+    def __init__(self, store: PlaylistStore, track: Callable[[int], Track]):
+        self.store = store
+        self.track = track
+
+    def __getitem__(self, pid):
+        return self.store.playlist(self.store.row(pid), self.track)
+
+    def __contains__(self, pid):
+        try:
+            self.store.row(pid)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.store.pid.tolist())
+
+    def __len__(self):
+        return len(self.store)
+
+    def values(self):
+        return PlaylistValues(self)
+
+    def items(self):
+        return PlaylistItems(self)
+
+
+class PlaylistValues(ValuesView):
+    def __iter__(self):
+        store, track = self._mapping.store, self._mapping.track
+        return (store.playlist(row, track) for row in range(len(store)))
+
+
+class PlaylistItems(ItemsView):
+    def __iter__(self):
+        store, track = self._mapping.store, self._mapping.track
+        return ((pid, store.playlist(row, track)) for row, pid in enumerate(store.pid.tolist()))
@@ -0,0 +1,9 @@
+class Slotted:
+    __slots__ = ()
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for cls in type(self).__mro__ for name in getattr(cls, '__slots__', ())}
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
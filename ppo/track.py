@@ -1,7 +1,10 @@
-from typeguard import typechecked
+from ppo.slotted import Slotted
+from utils.typecheck_util import typechecked
 
 
-class Track:
+class Track(Slotted):
+    __slots__ = ('track_id', 'artist_id', 'album_id', 'duration')
+
     @typechecked
     def __init__(self, track_id: str, artist_id: str, album_id, duration: int):
         self.track_id = track_id
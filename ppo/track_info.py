@@ -1,9 +1,12 @@
-from typeguard import typechecked
+from ppo.slotted import Slotted
+from utils.typecheck_util import typechecked
 
 
-class TrackInfo:
+class TrackInfo(Slotted):
+    __slots__ = ('track_id', 'name', 'album', 'duration', 'explicit', 'is_local', 'popularity', 'artist_ids')
+
     @typechecked
-    def __init__(self, track_id: str, name: str, album: str, duration: int, explicit: bool | None, is_local: bool | None, popularity: int | None, artist_ids: set[str]):
+    def __init__(self, track_id: int, name: str, album: str, duration: int, explicit: bool | None, is_local: bool | None, popularity: int | None, artist_ids: set[int]):
         self.track_id = track_id
         self.name = name
         self.album = album
@@ -16,9 +19,9 @@ class TrackInfo:
     def __eq__(self, other):
         if hasattr(other, "track_id"):
             return self.track_id == other.track_id
-        if type(other) == str:
+        if type(other) == int:
             return self.track_id == other
-        raise ValueError('{} is neither str nor Track')
+        raise ValueError('{} is neither int nor Track')
 
     def __hash__(self):
         return hash(self.track_id)
@@ -0,0 +1,56 @@
+import argparse
+import time
+import tracemalloc
+
+from ppo.audio_feature import AudioFeature
+from ppo.playlist import Playlist
+from ppo.track import Track
+from ppo.track_info import TrackInfo
+from utils import TYPECHECK
+
+
+def make_tracks(n):
+    return [Track(f'spotify:track:{i}', f'spotify:artist:{i % 1000}', f'spotify:album:{i % 5000}', 200_000)
+            for i in range(n)]
+
+
+def make_track_infos(n):
+    return [TrackInfo(i, 'name', 'album', 200_000, False, False, 50, {i % 1000}) for i in range(n)]
+
+
+def make_audio_features(n):
+    return [AudioFeature(0.5, 0.5, -10.0, 0.1, 0.2, 0.0, 0.1, 0.5, 120.0, 1, 5) for _ in range(n)]
+
+
+def make_playlists(n, tracks):
+    return [Playlist(i, 'title', len(tracks), 0, False, 0, tracks) for i in range(n)]
+
+
+def measure(name, function):
+    start_time = time.perf_counter()
+    objects = function()
+    seconds = time.perf_counter() - start_time
+    del objects
+
+    tracemalloc.start()
+    objects = function()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{name:15s} {len(objects):>9d} objects {seconds:7.2f}s {size / len(objects):7.1f} bytes/object')
+    return objects
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    print(f'typecheck={TYPECHECK}')
+    tracks = measure('Track', lambda: make_tracks(args.n))
+    measure('TrackInfo', lambda: make_track_infos(args.n))
+    measure('AudioFeature', lambda: make_audio_features(args.n))
+    measure('Playlist', lambda: make_playlists(args.n // 100, tracks[:50]))
+
+
+if __name__ == '__main__':
+    main()
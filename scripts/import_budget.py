@@ -0,0 +1,54 @@
+import argparse
+import os
+import pkgutil
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import services
+
+HEAVY_MODULES = ['pandas', 'scipy', 'sklearn', 'causalinference']
+BUDGET = 0.5
+
+PROBE = '''
+import sys
+import {module}
+print(','.join(sorted({heavy} & {{name.split('.')[0] for name in sys.modules}})))
+'''
+
+
+def service_modules():
+    return sorted(f'services.{module.name}' for module in pkgutil.iter_modules(services.__path__))
+
+
+def measure(module, repeat=3):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    seconds = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = subprocess.run([sys.executable, '-c', PROBE.format(module=module, heavy=set(HEAVY_MODULES))],
+                                env=env, capture_output=True, text=True, check=True)
+        seconds.append(time.perf_counter() - start_time)
+    return min(seconds), [name for name in result.stdout.strip().split(',') if name]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--budget', type=float, default=BUDGET)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    failed = False
+    for module in service_modules():
+        seconds, heavy = measure(module, args.repeat)
+        over_budget = seconds > args.budget or heavy
+        failed |= bool(over_budget)
+        print(f'{"FAIL" if over_budget else "ok":4s} {module:40s} {seconds:6.2f}s {" ".join(heavy)}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
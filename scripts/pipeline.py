@@ -0,0 +1,176 @@
+import argparse
+import concurrent.futures
+import time
+from functools import partial
+
+from services import artist_matrix_service, artist_variance_service, causal_inference_service, coherence_service, \
+    feature_service, feature_variance_service, latex_table, normalized_feature_service, null_model_service, \
+    playlist_service, popularity_service, track_info_service
+from services.artist_matrix_service import ArtistMatrixService
+from services.artist_variance_service import ArtistVarianceService
+from services.causal_inference_service import CausalInferenceService
+from services.coherence_service import CoherenceService
+from services.feature_service import FeatureService
+from services.feature_variance_service import FeatureVarianceService
+from services.id_service import clear_id_services
+from services.normalized_feature_service import NormalizedFeatureService
+from services.null_model_service import NullModelService
+from services.num_edits_service import NumEditsService
+from services.playlist_service import PlaylistService
+from services.popularity_service import PopularityService
+from services.track_info_service import TrackInfoService
+
+
+class Stage:
+    def __init__(self, name, save, outputs, dependencies=(), writes_ids=False):
+        self.name = name
+        self.save = save
+        self.outputs = outputs
+        self.dependencies = list(dependencies)
+        self.writes_ids = writes_ids
+
+
+def playlist_outputs():
+    return [PlaylistService(filtered=False), PlaylistService(), NumEditsService()]
+
+
+def feature_outputs():
+    return [FeatureService()]
+
+
+def normalized_feature_outputs():
+    return [NormalizedFeatureService().depends_on(FeatureService())]
+
+
+def null_model_outputs():
+    return [NullModelService().depends_on(PlaylistService(), NormalizedFeatureService())]
+
+
+def popularity_outputs():
+    return [PopularityService().depends_on(PlaylistService(filtered=False))]
+
+
+def feature_variance_outputs(shuffled):
+    return [FeatureVarianceService(shuffled=shuffled).depends_on(PlaylistService(), NormalizedFeatureService())]
+
+
+def track_info_outputs():
+    return [TrackInfoService()]
+
+
+def artist_matrix_outputs():
+    return [ArtistMatrixService().depends_on(PlaylistService(), TrackInfoService())]
+
+
+def artist_variance_outputs(shuffled):
+    return [ArtistVarianceService(shuffled=shuffled).depends_on(PlaylistService(), ArtistMatrixService())]
+
+
+def coherence_outputs(shuffled):
+    return [CoherenceService(shuffled=shuffled).depends_on(PlaylistService(), NumEditsService(), PopularityService(),
+                                                           FeatureVarianceService(shuffled=shuffled),
+                                                           ArtistVarianceService(shuffled=shuffled))]
+
+
+def causal_inference_outputs(shuffled):
+    return [CausalInferenceService(shuffled=shuffled).depends_on(CoherenceService(shuffled=shuffled))]
+
+
+def no_outputs():
+    return []
+
+
+def get_stages(variants=(False, True)):
+    stages = [
+        Stage('playlists', playlist_service.save_all, playlist_outputs, writes_ids=True),
+        Stage('features', feature_service.save, feature_outputs, ['playlists'], writes_ids=True),
+        Stage('normalized_features', normalized_feature_service.save, normalized_feature_outputs, ['features']),
+        Stage('popularity', popularity_service.save, popularity_outputs, ['playlists']),
+        Stage('null_model', null_model_service.save, null_model_outputs, ['playlists', 'normalized_features']),
+        Stage('track_info', track_info_service.save, track_info_outputs, ['playlists'], writes_ids=True),
+        Stage('artist_matrix', artist_matrix_service.save, artist_matrix_outputs, ['playlists', 'track_info']),
+    ]
+    for shuffled in variants:
+        suffix = '_shuffled' if shuffled else ''
+        stages += [
+            Stage('feature_variances' + suffix, partial(feature_variance_service.save, shuffled=shuffled),
+                  partial(feature_variance_outputs, shuffled), ['playlists', 'normalized_features']),
+            Stage('artist_variances' + suffix, partial(artist_variance_service.save, shuffled=shuffled),
+                  partial(artist_variance_outputs, shuffled), ['playlists', 'artist_matrix']),
+            Stage('coherence' + suffix, partial(coherence_service.save, shuffled=shuffled),
+                  partial(coherence_outputs, shuffled),
+                  ['playlists', 'popularity', 'feature_variances' + suffix, 'artist_variances' + suffix]),
+            Stage('causal_inference' + suffix, partial(causal_inference_service.save, shuffled=shuffled),
+                  partial(causal_inference_outputs, shuffled), ['coherence' + suffix]),
+            Stage('latex_table' + suffix, partial(latex_table.save, shuffled=shuffled), no_outputs,
+                  ['coherence' + suffix, 'causal_inference' + suffix]),
+        ]
+    return {stage.name: stage for stage in stages}
+
+
+def execute(stage: Stage, force=False):
+    start_time = time.time()
+    clear_id_services()
+    outputs = stage.outputs()
+    if outputs and not force and all(service.is_cached() for service in outputs):
+        return 'cached', time.time() - start_time
+    stage.save()
+    return 'built', time.time() - start_time
+
+
+def run(stages, max_workers=4, force=()):
+    done, failed, skipped, timings = set(), set(), set(), {}
+    running = {}
+    start_time = time.time()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while len(done) + len(failed) + len(skipped) < len(stages):
+            for name, stage in stages.items():
+                if name in done or name in failed or name in skipped or name in running.values():
+                    continue
+                if any(dependency in failed or dependency in skipped for dependency in stage.dependencies):
+                    skipped.add(name)
+                    print(f'[skipped] {name}')
+                    continue
+                if not all(dependency in done for dependency in stage.dependencies):
+                    continue
+                if stage.writes_ids and any(stages[other].writes_ids for other in running.values()):
+                    continue
+                print(f'[started] {name}')
+                running[executor.submit(execute, stage, name in force)] = name
+            if not running:
+                continue
+
+            finished, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    status, seconds = future.result()
+                    done.add(name)
+                    print(f'[{status}] {name} {seconds:.1f}s')
+                except Exception as e:
+                    status, seconds = 'failed', float('nan')
+                    failed.add(name)
+                    print(f'[failed] {name}: {e!r}')
+                timings[name] = status, seconds
+
+    print(f'{"stage":30s} {"status":10s} {"seconds":>10s}')
+    for name in stages:
+        status, seconds = timings.get(name, ('skipped', float('nan')))
+        print(f'{name:30s} {status:10s} {seconds:10.1f}')
+    print(f'{"total":30s} {"":10s} {time.time() - start_time:10.1f}')
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--variants', choices=['both', 'unshuffled', 'shuffled'], default='both')
+    parser.add_argument('--force', nargs='*', default=[])
+    args = parser.parse_args()
+
+    variants = {'both': (False, True), 'unshuffled': (False,), 'shuffled': (True,)}[args.variants]
+    run(get_stages(variants), max_workers=args.workers, force=set(args.force))
+
+
+if __name__ == '__main__':
+    main()
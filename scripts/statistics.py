@@ -1,3 +1,5 @@
+import numpy as np
+
 from services.feature_service import FeatureService
 from services.num_edits_service import NumEditsService
 from services.playlist_service import PlaylistService
@@ -5,13 +7,17 @@ from services.track_info_service import TrackInfoService
 
 
 def missing_audio_features(playlist_service: PlaylistService, feature_service: FeatureService):
-    total_tracks = len(playlist_service.track_service.tracks)
-    track_counter = sum(1 for track_id in playlist_service.track_service.tracks if track_id in feature_service)
+    counts = playlist_service.track_service.count
+    has_feature = np.zeros(len(counts), dtype=bool)
+    has_feature[[track_id for track_id in feature_service.features if track_id < len(counts)]] = True
+
+    total_tracks = np.count_nonzero(counts)
+    track_counter = np.count_nonzero(counts[has_feature])
 
     print(f'Tracks: f{track_counter} from {total_tracks} -> {track_counter / total_tracks}')
 
-    total_entries = sum(counts for _, counts in playlist_service.track_service.count.items())
-    entry_counter = sum(counts for track_id, counts in playlist_service.track_service.count.items() if track_id in feature_service)
+    total_entries = counts.sum()
+    entry_counter = counts[has_feature].sum()
 
     print(f'Entries: f{entry_counter} from {total_entries} -> {entry_counter / total_entries}')
 
@@ -26,33 +32,34 @@ def num_edits_stats(playlist_service: PlaylistService, num_edits_service: NumEdi
     print(f'Two #Edits: {two_edits} from {len(num_edits)} -> {two_edits / len(num_edits)}')
 
 def artist_albums(playlist_service: PlaylistService):
-    num_albums = [len(set(t.album_id for t in playlist.tracks)) for playlist in playlist_service.playlists.values()]
-    num_artists = [len(set(t.artist_id for t in playlist.tracks)) for playlist in playlist_service.playlists.values()]
+    store = playlist_service.store
+    track_service = playlist_service.track_service
+    num_albums = [len(np.unique(track_service.album_idx[store.track_indices(row)])) for row in range(len(store))]
+    num_artists = [len(np.unique(track_service.artist_idx[store.track_indices(row)])) for row in range(len(store))]
 
     print(f'Min Albums: {min(num_albums)}')
     print(f'Min Artists: {min(num_artists)}')
 
 
 def print_collaborative(playlist_service: PlaylistService):
-    total = len(playlist_service.playlists)
-    collabs = sum(1 for pl in playlist_service.playlists.values() if pl.is_collaborative)
+    total = len(playlist_service.store)
+    collabs = np.count_nonzero(playlist_service.store.is_collaborative)
 
     print(f'Collaborative: f{collabs} from {total} -> {collabs / total}')
 
 
 def track_info(playlist_service: PlaylistService):
     track_counts = playlist_service.track_service.count
-    total = len(track_counts)
+    total = np.count_nonzero(track_counts)
 
-    single_usages = sum(1 for c in track_counts.values() if c == 1)
+    single_usages = np.count_nonzero(track_counts == 1)
 
     print(f'Single Tracks: f{single_usages} from {total} -> {single_usages / total}')
 
 
 def artist_counts(playlist_service: PlaylistService, track_info_service: TrackInfoService):
-    artists = set()
-    for track in playlist_service.track_service.tracks.values():
-        artists.add(track.artist_id)
+    track_service = playlist_service.track_service
+    artists = set(track_service.artist_idx[track_service.count > 0].tolist())
 
     print(f'Total Artists: {len(artists)}')
 
@@ -1,99 +1,125 @@
 import os
+from array import array
 
 import numpy as np
 from bidict import bidict
-from scipy.sparse import lil_matrix, coo_matrix
 
 from services import CACHED_PATH
 from services.playlist_service import PlaylistService
 from services.service import Service
 from services.track_info_service import TrackInfoService
 
+BATCH_SIZE = 100_000
+
 
 class ArtistMatrixService(Service):
 
-    def __init__(self, cached_path=CACHED_PATH):
+    def __init__(self, seed=42, cached_path=CACHED_PATH, mmap=False):
         filepath = os.path.join(cached_path, 'artist_matrix_service.pk')
+        self.seed = seed
         self.artist_to_id = bidict()
         self.track_to_ids = {}
         self.artist_in_playlist_count = {}
-        self.matrix = coo_matrix((0, 0), dtype=np.float32)
-        super().__init__(filepath)
-
-    def init_mapping(self, playlist_service: PlaylistService, track_service: TrackInfoService):
-        data = {}
-        for pid, playlist in playlist_service.playlists.items():
-            playlist_artist_ids = {}
-            for track in playlist.tracks:
-                track_id = track.track_id
-                if track_id in self.track_to_ids:
-                    track_artist_ids = self.track_to_ids[track_id]
-                else:
-                    track_artists = {track.artist_id}
-                    if track.track_id in track_service:
-                        track_artists.update(track_service[track_id].artist_ids)
-
-                    track_artist_ids = []
-                    for artist in track_artists:
-                        if artist in self.artist_to_id:
-                            artist_id = self.artist_to_id[artist]
-                        else:
-                            artist_id = len(self.artist_to_id)
-                            self.artist_to_id[artist] = artist_id
-                        track_artist_ids.append(artist_id)
-                    self.track_to_ids[track_id] = track_artist_ids
-                for artist_id in track_artist_ids:
-                    playlist_artist_ids[artist_id] = playlist_artist_ids.get(artist_id, 0) + 1
-
-            for artist_id in playlist_artist_ids:
-                self.artist_in_playlist_count[artist_id] = self.artist_in_playlist_count.get(artist_id, 0) + 1
-            data[pid] = playlist_artist_ids
-        return data
+        self.matrix = None
+        super().__init__(filepath, mmap)
+
+    def init_mapping(self, playlist_service: PlaylistService, track_service: TrackInfoService,
+                     batch_size=BATCH_SIZE):
+        from scipy.sparse import csr_matrix, vstack
+
+        store = playlist_service.store
+        track_artist_idx = playlist_service.track_service.artist_idx
+        artist_to_id = {}
+        _, first = np.unique(store.track_idx, return_index=True)
+        track_ids = store.track_idx[np.sort(first)]
+        lengths = np.zeros(len(track_ids), dtype=np.int64)
+        artist_ids = array('i')
+        for i, track_id in enumerate(track_ids.tolist()):
+            track_artists = {int(track_artist_idx[track_id])}
+            if track_id in track_service.track_info:
+                track_artists.update(track_service.track_info[track_id].artist_ids)
+            for artist in track_artists:
+                artist_ids.append(artist_to_id.setdefault(artist, len(artist_to_id)))
+            lengths[i] = len(track_artists)
+        self.artist_to_id = bidict(artist_to_id)
+        artist_ids = np.frombuffer(artist_ids, dtype=np.int32).copy()
 
-    def permutate_data(self, data):
         n = len(self.artist_to_id)
-        permutation = np.random.permutation(n)
-
-        perm_track_to_ids = {}
-        for track_id, artist_ids in self.track_to_ids.items():
-            perm_track_to_ids[track_id] = [permutation[artist_id] for artist_id in artist_ids]
-        self.track_to_ids = perm_track_to_ids
-
-        perm_artist_to_id = bidict()
-        for artist, artist_id in self.artist_to_id.items():
-            perm_artist_to_id[artist] = permutation[artist_id]
-        self.artist_to_id = perm_artist_to_id
-
-        perm_data = {}
-        for pid, playlist_artist_ids in data.items():
-            perm_playlist_artist_ids = {}
-            for artist_id, count in playlist_artist_ids.items():
-                perm_playlist_artist_ids[permutation[artist_id]] = count
-            perm_data[pid] = perm_playlist_artist_ids
+        track_lengths = np.zeros(int(track_ids.max(initial=-1)) + 1, dtype=np.int64)
+        track_starts = np.zeros_like(track_lengths)
+        track_lengths[track_ids] = lengths
+        track_starts[track_ids] = np.cumsum(lengths) - lengths
+
+        matrices = []
+        for start in range(0, len(store), batch_size):
+            offsets = store.offsets[start:start + batch_size + 1]
+            entries = store.track_idx[offsets[0]:offsets[-1]]
+            rows = np.repeat(np.arange(len(offsets) - 1, dtype=np.int32), np.diff(offsets))
+            counts = track_lengths[entries]
+            positions = np.repeat(track_starts[entries] - np.cumsum(counts) + counts, counts)
+            positions += np.arange(len(positions))
+            matrix = csr_matrix((np.ones(len(positions), dtype=np.int32),
+                                 (np.repeat(rows, counts), artist_ids[positions])), shape=(len(offsets) - 1, n))
+            matrix.sum_duplicates()
+            matrices.append(matrix)
+        data = vstack(matrices, format='csr') if matrices else csr_matrix((0, n), dtype=np.int32)
+        return data, (track_ids, lengths, artist_ids)
+
+    def permutate_data(self, data, track_artists):
+        n = len(self.artist_to_id)
+        permutation = np.random.default_rng(self.seed).permutation(n).astype(np.int32)
+        _, _, artist_ids = track_artists
+        np.take(permutation, artist_ids, out=artist_ids)
+        np.take(permutation, data.indices, out=data.indices)
+        data.has_sorted_indices = False
+        data.sort_indices()
+        self.artist_to_id = bidict(zip(self.artist_to_id.keys(), permutation.tolist()))
+        return data
 
-        return perm_data
+    def init_track_to_ids(self, track_artists):
+        track_ids, lengths, artist_ids = track_artists
+        artist_ids = artist_ids.tolist()
+        ends = np.cumsum(lengths).tolist()
+        self.track_to_ids = {track_id: artist_ids[end - length:end]
+                             for track_id, length, end in zip(track_ids.tolist(), lengths.tolist(), ends)}
+
+    def track_artist_arrays(self):
+        track_ids = np.fromiter(self.track_to_ids.keys(), dtype=np.int64, count=len(self.track_to_ids))
+        lengths = np.zeros(int(track_ids.max(initial=-1)) + 2, dtype=np.int64)
+        lengths[track_ids + 1] = np.fromiter(map(len, self.track_to_ids.values()), dtype=np.int64,
+                                             count=len(track_ids))
+        offsets = np.cumsum(lengths)
+        artist_ids = np.empty(offsets[-1], dtype=np.int32)
+        for track_id, ids in self.track_to_ids.items():
+            artist_ids[offsets[track_id]:offsets[track_id + 1]] = ids
+        return offsets, artist_ids
+
+    def init_counts(self, data):
+        n = data.shape[1]
+        self.artist_in_playlist_count = dict(enumerate(np.bincount(data.indices, minlength=n).tolist()))
 
     def normalize_data(self, data):
-        for pid, playlist_artist_ids in data.items():
-            max_term = max(playlist_artist_ids.values())
-            for artist_id, count in playlist_artist_ids.items():
-                tf = count / max_term
-                idf = np.log(len(data) / self.artist_in_playlist_count[artist_id])
-                playlist_artist_ids[artist_id] = tf * idf
+        n_playlists, n = data.shape
+        in_playlist_count = np.array([self.artist_in_playlist_count[artist_id] for artist_id in range(n)],
+                                     dtype=np.float64)
+        idf = np.log(n_playlists / in_playlist_count)
+        max_term = data.max(axis=1).toarray().ravel()
+        data = data.astype(np.float64)
+        data.data = data.data / np.repeat(max_term, np.diff(data.indptr)) * idf[data.indices]
+        return data
 
     def init_matrix(self, data):
-        n = len(self.artist_to_id)
-        m = len(data)
-        matrix = lil_matrix((m, n), dtype=np.float32)
-        for i, playlist_artist_ids in enumerate(data.values()):
-            for artist_id, count in playlist_artist_ids.items():
-                matrix[i, artist_id] = count
-        return coo_matrix(matrix)
+        matrix = data.astype(np.float32)
+        matrix.eliminate_zeros()
+        return matrix.tocoo()
 
     def load_from_data(self, playlist_service: PlaylistService, track_service: TrackInfoService):
-        data = self.init_mapping(playlist_service, track_service)
-        data = self.permutate_data(data)
-        self.normalize_data(data)
+        self.depends_on(playlist_service, track_service)
+        data, track_artists = self.init_mapping(playlist_service, track_service)
+        data = self.permutate_data(data, track_artists)
+        self.init_track_to_ids(track_artists)
+        self.init_counts(data)
+        data = self.normalize_data(data)
         self.matrix = self.init_matrix(data)
 
     def save(self):
@@ -1,46 +1,84 @@
 import concurrent.futures
 import os
 import time
-from random import Random
 
 import numpy as np
-from more_itertools import batched
-from sklearn.metrics.pairwise import cosine_distances
 
 from services import CACHED_PATH
 from services.artist_matrix_service import ArtistMatrixService
 from services.playlist_service import PlaylistService
 from services.service import Service
+from utils.cosine_cache import CosineDistanceCache, normalize_columns, cosine_distances, hit_rate
+from utils.shared_util import shared_arrays, attach, attached
+from utils.shuffle_util import playlist_order
 
+BATCH_SIZE = 2350
+TASK_SIZE = 25
+CACHE_BYTES = 2 << 30
+TOP_K = 20_000
 
-def embedding_similarity(a_embeddings, b_embeddings):
-    return np.mean(cosine_distances(a_embeddings.T, b_embeddings.T))
+_cache: CosineDistanceCache | None = None
+_matrix = None
 
 
-def playlist_variance(embeddings):
-    sum_ = 0
-    n = len(embeddings)
-    for i, a_track in enumerate(embeddings[:-1]):
-        for j, b_track in enumerate(embeddings[i + 1:]):
-            sum_ += embedding_similarity(a_track, b_track) ** 2
-    div = n * (n - 1)
-    return sum_ / div, div // 2
+def attach_worker(shared):
+    from scipy.sparse import csc_matrix
 
+    global _cache, _matrix
+    attach(shared)
+    arrays = attached()
+    _matrix = csc_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape=tuple(arrays['shape']),
+                         copy=False)
+    if 'hot' in arrays:
+        _cache = CosineDistanceCache(arrays['index'], arrays['hot'])
 
-def sequential_variance(embeddings):
-    sum_ = 0
-    n = len(embeddings)
-    for i, a_artists in enumerate(embeddings[:-1]):
-        b_artists = embeddings[i + 1]
-        sum_ += embedding_similarity(a_artists, b_artists) ** 2
 
-    return sum_ / (n - 1) / 2, n - 1
+def artist_distances(columns, artist_ids=None):
+    if _cache is None or artist_ids is None:
+        columns = normalize_columns(columns)
+        return cosine_distances(columns, columns)
+    return _cache.distances(artist_ids, columns)
 
 
-def embedding_to_variance(pid, embeddings):
-    pl_var, p_c = playlist_variance(embeddings)
-    sq_var, s_c = sequential_variance(embeddings)
-    return pid, sq_var, pl_var, s_c, p_c, len(embeddings)
+def track_distances(distances, track_artists, lengths):
+    from scipy.sparse import csr_matrix
+
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    membership = csr_matrix((np.ones(len(rows)), (rows, track_artists)), shape=(len(lengths), len(distances)))
+    return membership @ (membership @ distances).T / np.outer(lengths, lengths)
+
+
+def embedding_to_variance(pid, columns, track_artists, lengths, artist_ids=None):
+    n = len(lengths)
+    if n < 2:
+        return pid, float('nan'), float('nan'), 0, 0, n
+    squares = np.square(track_distances(artist_distances(columns, artist_ids), track_artists, lengths))
+    pl_var = np.triu(squares, 1).sum() / (n * (n - 1))
+    sq_var = np.diagonal(squares, 1).sum() / (n - 1) / 2
+    return pid, sq_var, pl_var, n - 1, n * (n - 1) // 2, n
+
+
+def range_variances(start, end, shuffled, seed):
+    arrays = attached()
+    counters = np.zeros(2, dtype=np.int64) if _cache is None else _cache.counters()
+    variances = {}
+    for row in range(start, end):
+        pid = int(arrays['pid'][row])
+        track_ids = arrays['track_idx'][arrays['offsets'][row]:arrays['offsets'][row + 1]]
+        if shuffled:
+            track_ids = track_ids[playlist_order(seed, pid, len(track_ids))]
+        starts = arrays['track_offsets'][track_ids]
+        lengths = arrays['track_offsets'][track_ids + 1] - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        positions += np.arange(len(positions))
+        artist_ids, track_artists = np.unique(arrays['track_artists'][positions], return_inverse=True)
+
+        _, sq_var, pl_var, s_c, p_c, track_len = embedding_to_variance(pid, _matrix[:, artist_ids], track_artists,
+                                                                       lengths, artist_ids)
+        variances[pid] = sq_var, pl_var, s_c, p_c, track_len
+    if _cache is not None:
+        counters = _cache.counters() - counters
+    return variances, counters
 
 
 class ArtistVarianceService(Service):
@@ -57,41 +95,56 @@ class ArtistVarianceService(Service):
         self.variances = {}
         super().__init__(filepath)
 
-    def load_from_data(self, playlists, artist_matrix_service: ArtistMatrixService):
-        random = Random(self.seed)
+    def load_from_data(self, playlist_service: PlaylistService, artist_matrix_service: ArtistMatrixService,
+                       top_k=0, max_bytes=CACHE_BYTES, max_workers=47, shared_path=None):
+        self.depends_on(playlist_service, artist_matrix_service)
+        store = playlist_service.store
         start_time = time.time()
-        track_to_ids = artist_matrix_service.track_to_ids
         matrix = artist_matrix_service.matrix.tocsc()
-
-        if os.path.exists(self.filepath):
-            self.load_from_cache()
-
-        for i, batch in enumerate(batched(playlists, 2350)):
-            print(f"--- {(time.time() - start_time)} seconds for {i} ---")
-            start_time = time.time()
-            current_size = len(self.variances)
-
-            futures = []
-            with concurrent.futures.ProcessPoolExecutor(max_workers=47) as executor:
-                print(f"Starting {i}")
-                for playlist in batch:
-                    if playlist.playlist_id in self.variances:
+        track_offsets, track_artists = artist_matrix_service.track_artist_arrays()
+
+        chunks = self._load_checkpoints()
+        for variances in chunks.values():
+            self.variances.update(variances)
+
+        with shared_arrays(shared_path) as shared:
+            for name, array in [('pid', store.pid), ('offsets', store.offsets), ('track_idx', store.track_idx),
+                                ('track_offsets', track_offsets), ('track_artists', track_artists),
+                                ('data', matrix.data), ('indices', matrix.indices), ('indptr', matrix.indptr),
+                                ('shape', np.array(matrix.shape))]:
+                shared.put(name, array)
+            if top_k > 0:
+                counts = artist_matrix_service.artist_in_playlist_count
+                cache = CosineDistanceCache.top_k(matrix, [counts[i] for i in range(matrix.shape[1])], top_k,
+                                                  max_bytes)
+                shared.put('index', cache.index)
+                shared.put('hot', cache.hot)
+                print(f"Cached {len(cache.hot)} artists")
+            del matrix
+
+            counters = np.zeros(2, dtype=np.int64)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=attach_worker,
+                                                        initargs=(shared,)) as executor:
+                for i, start in enumerate(range(0, len(store), BATCH_SIZE)):
+                    print(f"--- {(time.time() - start_time)} seconds for {i} ---")
+                    start_time = time.time()
+                    end = min(start + BATCH_SIZE, len(store))
+                    if (start, end) in chunks:
                         continue
-                    track_ids = [t.track_id for t in playlist.tracks]
-                    if self.shuffled:
-                        random.shuffle(track_ids)
-                    embeddings = [matrix[:, track_to_ids[tid]] for tid in track_ids]
-
-                    future = executor.submit(embedding_to_variance, pid=playlist.playlist_id, embeddings=embeddings)
-                    futures.append(future)
-                print(f"Waiting {i}")
-                for f in futures:
-                    pid, sq_var, pl_var, s_c, p_c, track_len = f.result()
-                    self.variances[pid] = sq_var, pl_var, s_c, p_c, track_len
-            if current_size < len(self.variances):
-                print(f"Saving {i}")
-                self.save()
-                print(f"Done Saving {i}")
+
+                    print(f"Starting {i}")
+                    futures = [executor.submit(range_variances, task_start, min(task_start + TASK_SIZE, end),
+                                               self.shuffled, self.seed)
+                               for task_start in range(start, end, TASK_SIZE)]
+                    variances = {}
+                    for f in futures:
+                        task_variances, delta = f.result()
+                        variances.update(task_variances)
+                        counters += delta
+                    if top_k > 0:
+                        print(f"Cache hit rate {hit_rate(counters):.3f} (hits, misses: {counters.tolist()})")
+                    self.variances.update(variances)
+                    self._checkpoint(start, end, variances)
 
     def save(self):
         self._save(self.variances)
@@ -100,7 +153,7 @@ class ArtistVarianceService(Service):
         self.variances = self._load_from_cache()
 
 
-def save(shuffled=False):
+def save(shuffled=False, top_k=TOP_K):
     playlist_service = PlaylistService()
     playlist_service.load_from_cache()
 
@@ -108,7 +161,7 @@ def save(shuffled=False):
     artist_matrix_service.load_from_cache()
 
     artist_variance_service = ArtistVarianceService(shuffled=shuffled)
-    artist_variance_service.load_from_data(playlist_service.playlists.values(), artist_matrix_service)
+    artist_variance_service.load_from_data(playlist_service, artist_matrix_service, top_k=top_k)
     artist_variance_service.save()
     print('Finished')
 
@@ -1,9 +1,6 @@
 import os
 
 import numpy as np
-import pandas as pd
-from causalinference import CausalModel
-from scipy.stats import norm
 
 from services import CACHED_PATH
 from services.service import Service
@@ -11,6 +8,8 @@ from services.coherence_service import CoherenceService
 
 
 def is_significant(estimator, p_value=0.05 / (11 * 2 * 3 + 11)):
+    from scipy.stats import norm
+
     z = estimator['ate'] / estimator['ate_se']
     p = 2 * (1 - norm.cdf(np.abs(z)))
     return p_value > p
@@ -44,6 +43,9 @@ class CausalInferenceService(Service):
         super().__init__(filepath)
 
     def causal_inference(self, data, rand_int, replacements, categorical, dependent_variable):
+        import pandas as pd
+        from causalinference import CausalModel
+
         assert categorical in self.independent_variables
         prosperity_features = [f for f in self.prosperity_features if categorical[2:] not in f]
         assert len(prosperity_features) == len(self.prosperity_features) - 1
@@ -98,15 +100,19 @@ class CausalInferenceService(Service):
 
     def load_from_data(self, significance_service: CoherenceService):
         assert self.shuffled == significance_service.shuffled
+        self.depends_on(significance_service)
 
         rand_iter = iter(self.seed_sequence)
 
-        if self.used_cached and os.path.exists(self.filepath):
+        if self.used_cached and self.is_cached():
             self.load_from_cache()
+        chunks = self._load_checkpoints()
 
-        for categorical in self.independent_variables:
-            for dependent_variable in significance_service.features:
+        for i, categorical in enumerate(self.independent_variables):
+            for j, dependent_variable in enumerate(significance_service.features):
                 dict_ = self.data.setdefault(categorical, {}).setdefault(dependent_variable, {})
+                cell = i * len(significance_service.features) + j
+                dict_.update(chunks.get((cell, cell + 1), {}))
                 if categorical == 'c_collaborative':
                     if 0 in dict_:
                         next(rand_iter)
@@ -118,18 +124,18 @@ class CausalInferenceService(Service):
                                                      categorical, dependent_variable)
                 else:
                     replacements = [(0, False, 1, True), (0, False, 2, True)]
-                    for i in range(2):
-                        if i in dict_:
+                    for k in range(2):
+                        if k in dict_:
                             next(rand_iter)
                             next(rand_iter)
                             continue
-                        dict_[i] = self.causal_inference(significance_service.data,
+                        dict_[k] = self.causal_inference(significance_service.data,
                                                          rand_iter,
-                                                         replacements[i],
+                                                         replacements[k],
                                                          categorical, dependent_variable)
                         if self.shuffled:
-                            assert not is_significant(dict_[i]['estimates']['weighting'])
-                self.save()
+                            assert not is_significant(dict_[k]['estimates']['weighting'])
+                self._checkpoint(cell, cell + 1, dict_)
 
     def save(self):
         self._save(self.data)
@@ -1,11 +1,9 @@
 import math
 import os
 import sys
-from types import NoneType
+from typing import TYPE_CHECKING
 
 import numpy as np
-import pandas as pd
-from scipy import stats
 
 from ppo.audio_feature import AudioFeature
 from services import CACHED_PATH
@@ -17,6 +15,9 @@ from services.popularity_service import PopularityService
 from services.service import Service
 from utils.variance_util import get_coherence
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 def categorizes(data, get_idx, set_idx=None, percentile=None):
     if set_idx is None:
@@ -38,29 +39,36 @@ def categorizes(data, get_idx, set_idx=None, percentile=None):
 
 class CoherenceService(Service):
 
-    def __init__(self, min_samples=11, min_threshold=1e-6, shuffled=False, cached_path=CACHED_PATH):
+    def __init__(self, min_samples=11, min_threshold=1e-6, shuffled=False, cached_path=CACHED_PATH, mmap=False,
+                 lag=None):
+        filename = 'coherence_service' if lag is None else f'coherence_service_lag_{lag:02d}'
         if shuffled:
-            filepath = os.path.join(cached_path, 'coherence_service_shuffled.pk')
+            filepath = os.path.join(cached_path, filename + '_shuffled.pk')
         else:
-            filepath = os.path.join(cached_path, 'coherence_service.pk')
+            filepath = os.path.join(cached_path, filename + '.pk')
 
         self.shuffled = shuffled
+        self.lag = lag
         self.min_samples = min_samples
         self.min_threshold = min_threshold
 
-        self.data: pd.DataFrame | NoneType = None
+        self.data: 'pd.DataFrame | None' = None
         self.features = list(AudioFeature.feature_labels) + ['artists']
 
         self.independent_variables = ['c_length', 'c_num_edits', 'c_popularity', 'c_collaborative']
         self.dependent_variables = ['artists', 'loudness', 'energy', 'danceability', 'acousticness', 'valence',
                                     'speechiness', 'instrumentalness', 'liveness', 'tempo', 'tonality']
-        super().__init__(filepath)
+        super().__init__(filepath, mmap)
 
     def load_from_data(self, playlist_service,
                        num_edits_service: NumEditsService,
                        popularity_service: PopularityService,
                        variance_service: FeatureVarianceService,
                        artist_variance_service: ArtistVarianceService):
+        import pandas as pd
+
+        self.depends_on(playlist_service, num_edits_service, popularity_service, variance_service,
+                        artist_variance_service)
 
         assert variance_service.shuffled == self.shuffled
         assert artist_variance_service.shuffled == self.shuffled
@@ -74,12 +82,19 @@ class CoherenceService(Service):
         columns.append('c_collaborative')
         columns += self.features
 
+        variances = variance_service.variances
+        if self.lag is not None:
+            if self.lag not in variances.lags:
+                raise ValueError(f'lag {self.lag} was not computed, the feature variances have lags {variances.lags}')
+            variances = variances.at_lag(self.lag)
+
         index = []
         values = []
-        for pid, playlist in playlist_service.playlists.items():
+        store = playlist_service.store
+        for pid, is_collaborative in zip(store.pid.tolist(), store.is_collaborative.tolist()):
             row = []
-            var_dict, s_c, p_c, track_len = variance_service.variances[pid]
-            if s_c != track_len - 1 or track_len < self.min_samples:
+            var_dict, s_c, p_c, track_len = variances[pid]
+            if s_c != track_len - variances.lag or track_len < self.min_samples:
                 continue
 
             row.append(track_len)
@@ -98,12 +113,12 @@ class CoherenceService(Service):
             row.append(popularity)
             row.append(None)
 
-            row.append(int(playlist.is_collaborative))
+            row.append(int(is_collaborative))
 
             for label, (sq_var, pl_var) in var_dict.items():
                 row.append(get_coherence(sq_var, pl_var, self.min_threshold))
 
-            if pid in artist_variance_service.variances:
+            if variances.lag == 1 and pid in artist_variance_service.variances:
                 sq_var, pl_var, s_c, p_c, track_len = artist_variance_service.variances[pid]
                 if s_c < self.min_samples:
                     continue
@@ -121,6 +136,8 @@ class CoherenceService(Service):
         self.data = pd.DataFrame(values, index=index, columns=columns)
 
     def check_normality(self):
+        from scipy import stats
+
         for column in self.independent_variables:
             for feature in self.features:
                 if column == 'c_collaborative':
@@ -135,6 +152,8 @@ class CoherenceService(Service):
                     print(f'{column} | {feature:10s} | {i} | {result}', file=stdout)
 
     def check_homogeneity(self):
+        from scipy import stats
+
         dependent_frame = self.data[self.dependent_variables]
         values = dependent_frame.dropna()
 
@@ -145,6 +164,8 @@ class CoherenceService(Service):
         print(f'bartlett {homogeneity}')
 
     def check_size(self):
+        import pandas as pd
+
         rows = []
         for independent_variable in self.independent_variables:
             for dependent_variable in self.features:
@@ -160,6 +181,9 @@ class CoherenceService(Service):
         print(df)
 
     def correlation_analysis(self):
+        import pandas as pd
+        from scipy import stats
+
         rows = []
         index = []
         columns = ['size', 'corr', 'p_value']
@@ -179,6 +203,8 @@ class CoherenceService(Service):
         return pd.DataFrame(rows, index=pd.MultiIndex.from_tuples(index), columns=columns)
 
     def get_stats(self):
+        import pandas as pd
+
         rows = []
         index = []
         columns = ['size', 'min', 'q1', 'q2', 'q3', 'max', 'mean']
@@ -214,9 +240,11 @@ class CoherenceService(Service):
         self.data.to_json(self.get_export_path(filepath))
 
     def load_from_json(self, filepath='data'):
+        import pandas as pd
+
         self.data = pd.read_json(self.get_export_path(filepath))
 
-def save(shuffled=False):
+def save(shuffled=False, lag=None, lags=None):
     playlist_service = PlaylistService()
     playlist_service.load_from_cache()
 
@@ -226,13 +254,16 @@ def save(shuffled=False):
     num_edits_service = NumEditsService()
     num_edits_service.load_from_cache()
 
-    feature_variance_service = FeatureVarianceService(shuffled=shuffled)
+    if lags is None and lag is not None:
+        feature_variance_service = FeatureVarianceService(distance=lag, shuffled=shuffled)
+    else:
+        feature_variance_service = FeatureVarianceService(shuffled=shuffled, lags=lags)
     feature_variance_service.load_from_cache()
 
     artist_variance_service = ArtistVarianceService(shuffled=shuffled)
     artist_variance_service.load_from_cache()
 
-    significance_service = CoherenceService(shuffled=shuffled)
+    significance_service = CoherenceService(shuffled=shuffled, lag=lag)
     significance_service.load_from_data(playlist_service, num_edits_service, popularity_service,
                                         feature_variance_service, artist_variance_service)
     significance_service.save()
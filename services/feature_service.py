@@ -1,74 +1,121 @@
 import csv
 import os
 import re
+from collections import Counter
+from typing import Dict
+
+import numpy as np
 
 from ppo.audio_feature import AudioFeature
+from ppo.feature_matrix import FeatureMatrix
 from services import CACHED_PATH
+from services.id_service import IdService, load_id_service
 from services.service import Service
+from utils import MAX_WORKERS
+from utils.pool_util import ordered_map
+
+
+CHUNK_SIZE = 100_000
+SIMPLE_FEATURES = ['danceability', 'energy', 'speechiness', 'acousticness', 'instrumentalness', 'liveness', 'valence']
+
+
+def read_features(filepath, chunksize=CHUNK_SIZE):
+    import pandas as pd
+
+    labels = FeatureMatrix.labels
+    uris, values, modes, keys = [], [], [], []
+    rejected = Counter()
+    for chunk in pd.read_csv(filepath, sep='\t', header=None, names=range(12), dtype={0: str}, chunksize=chunksize,
+                             quoting=csv.QUOTE_NONE, float_precision='round_trip'):
+        numbers = chunk.iloc[:, 1:].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+        features, mode, key = numbers[:, :9], numbers[:, 9], numbers[:, 10]
+        reasons = np.full(len(chunk), None, dtype=object)
+
+        def reject(mask, reason):
+            reasons[mask & (reasons == None)] = reason
+
+        reject(np.isnan(numbers).any(axis=1) | chunk[0].isna().to_numpy(), 'malformed')
+        simple = features[:, [labels.index(label) for label in SIMPLE_FEATURES]]
+        for i, label in enumerate(SIMPLE_FEATURES):
+            reject((simple[:, i] < 0.0) | (simple[:, i] > 1.0), f'{label} out of range')
+        reject(simple.sum(axis=1) <= 0.0, 'no features')
+        tempo = features[:, labels.index('tempo')]
+        reject(((tempo < 30) | (tempo > 250)) & (tempo != 0.0), 'tempo out of range')
+        reject((mode != 0) & (mode != 1), 'mode out of range')
+        reject((key < 0) | (key > 12) | (key != np.floor(key)), 'key out of range')
+
+        accepted = reasons == None
+        rejected.update(reasons[~accepted].tolist())
+        uris.extend(chunk[0].to_numpy()[accepted].tolist())
+        values.append(features[accepted])
+        modes.append(mode[accepted].astype(np.int8))
+        keys.append(key[accepted].astype(np.int8))
+    if not values:
+        return uris, np.zeros((0, len(labels))), np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int8), rejected
+    return uris, np.concatenate(values), np.concatenate(modes), np.concatenate(keys), rejected
 
 
 class FeatureService(Service):
-    def __init__(self, cached_path=CACHED_PATH):
+    def __init__(self, cached_path=CACHED_PATH, id_service: IdService = None, dense=False, mmap=False):
         filepath = os.path.join(cached_path, f'feature_service.pk')
-        self.features = dict()
-        super().__init__(filepath)
-
-    @staticmethod
-    def line_to_feature(line):
-        uri = line[0]
-
-        danceability = float(line[1])
-        energy = float(line[2])
-        loudness = float(line[3])
-        speechiness = float(line[4])
-        acousticness = float(line[5])
-        instrumentalness = float(line[6])
-        liveness = float(line[7])
-        valence = float(line[8])
-        tempo = float(line[9])
-        mode = int(line[10])
-        key = int(line[11])
-
-        simple_features = [danceability, energy, speechiness, acousticness, instrumentalness, liveness, valence]
-        for f in simple_features:
-            assert 0.0 <= f <= 1.0
-        if sum(simple_features) <= 0.0:
-            return uri, None
-
-        assert 30 <= tempo <= 250 or tempo == 0.0
-        assert 0 == mode or 1 == mode
-        assert 0 <= key <= 12
-
-        return uri, AudioFeature(danceability, energy, loudness, speechiness, acousticness, instrumentalness, liveness,
-                                 valence, tempo, mode, key)
-
-    def load_from_data(self, directory='data/features'):
-        for file in next(os.walk(directory))[2]:
-            if not re.match(r'features_\d{3}.csv', file):
-                continue
-            reader = csv.reader(open(os.path.join(directory, file)), delimiter='\t')
-            for line in reader:
-                uri, feature = self.line_to_feature(line)
-                if feature is not None:
-                    self.features[uri] = feature
+        self.id_service = id_service if id_service is not None else load_id_service(cached_path)
+        self.dense = dense
+        self.features: Dict[int, AudioFeature] | FeatureMatrix = dict()
+        self.rejected = Counter()
+        super().__init__(filepath, mmap)
+
+    def load_from_data(self, directory='data/features', max_workers=1):
+        files = sorted(os.path.join(directory, file) for file in next(os.walk(directory))[2]
+                       if re.match(r'features_\d{3}.csv', file))
+        self.rejected = Counter()
+        track_ids, values, modes, keys = [], [], [], []
+        for uris, file_values, file_modes, file_keys, rejected in ordered_map(read_features, files, max_workers):
+            self.rejected.update(rejected)
+            track_ids.extend(self.id_service.tracks.intern(uri) for uri in uris)
+            values.append(file_values)
+            modes.append(file_modes)
+            keys.append(file_keys)
+        if self.rejected:
+            print(f'Rejected feature rows: {dict(self.rejected)}')
+        if not values:
+            return
+
+        values, modes, keys = np.concatenate(values), np.concatenate(modes), np.concatenate(keys)
+        if self.dense:
+            self.features = FeatureMatrix.from_arrays(track_ids, values, 12 * modes + keys,
+                                                      len(self.id_service.tracks))
+        else:
+            self.features = dict()
+            for track_id, row, mode, key in zip(track_ids, values.tolist(), modes.tolist(), keys.tolist()):
+                self.features[track_id] = AudioFeature(*row, mode, key)
+
+    def to_matrix(self):
+        if not isinstance(self.features, FeatureMatrix):
+            self.features = FeatureMatrix.from_dict(self.features, len(self.id_service.tracks))
+        self.dense = True
+
+    def get_many(self, items):
+        return FeatureMatrix.lookup(self.features, [self.id_service.track_id(item) for item in items])
 
     def save(self):
         self._save(self.features)
 
     def load_from_cache(self):
         self.features = self._load_from_cache()
+        self.dense = isinstance(self.features, FeatureMatrix)
 
     def __contains__(self, item):
-        return item in self.features
+        return self.id_service.track_id(item) in self.features
 
     def __getitem__(self, item):
-        return self.features[item]
+        return self.features[self.id_service.track_id(item)]
 
 
-def save():
-    feature_service = FeatureService()
-    feature_service.load_from_data()
+def save(dense=False, max_workers=MAX_WORKERS):
+    feature_service = FeatureService(dense=dense)
+    feature_service.load_from_data(max_workers=max_workers)
     feature_service.save()
+    feature_service.id_service.save()
     print('Finished')
 
 
@@ -1,111 +1,219 @@
 import concurrent.futures
 import os
-from random import Random
+from collections.abc import Mapping
 
-from more_itertools import batched
+import numpy as np
 
 from ppo.audio_feature import AudioFeature
+from ppo.feature_matrix import FeatureMatrix
 from services import CACHED_PATH
 from services.normalized_feature_service import NormalizedFeatureService
 from services.playlist_service import PlaylistService
 from services.service import Service
 from services.track_info_service import TrackInfoService
-from utils.variance_util import calc_variances, tonality_distance, pair_distance
-
-
-def features_to_variance(pid, features, artists, distance, threshold):
-    variances = {}
-    zipped = pid, list(zip(features['tonality'], artists))
-    _, t_sq_var, t_pl_var, t_s_c, t_p_c, t_track_len = calc_variances(zipped, distance=distance, threshold=threshold,
-                                                                      f=tonality_distance)
-
-    for label, feature in features.items():
-        if label == 'tonality':
-            continue
-        zipped = pid, list(zip(feature, artists))
-        _, sq_var, pl_var, s_c, p_c, track_len = calc_variances(zipped, distance=distance, threshold=threshold,
-                                                                f=pair_distance)
-        assert s_c == t_s_c
-        assert p_c == t_p_c
-        assert track_len == t_track_len
-        variances[label] = sq_var, pl_var
-    variances['tonality'] = t_sq_var, t_pl_var
-    return pid, variances, t_s_c, t_p_c, t_track_len
+from utils import MAX_WORKERS
+from utils.shared_util import shared_arrays, attach, attached
+from utils.shuffle_util import shuffle_order
+from utils.variance_util import batched_feature_variances, batched_tonality_variances, batched_thresholded_variances
+
+BATCH_SIZE = 50_000
+
+
+def batch_variances(offsets, data, codes, present, artists, lags, threshold):
+    if threshold > 0:
+        return batched_thresholded_variances(offsets, data, codes, artists, lags, threshold)
+    s, p, s_c, p_c, track_len = batched_feature_variances(offsets, data, present, lags)
+    t_s, t_p, t_s_c, t_p_c, _ = batched_tonality_variances(offsets, codes, lags)
+    assert np.array_equal(s_c, t_s_c) and np.array_equal(p_c, t_p_c)
+    return np.concatenate((s, t_s[:, None, :]), axis=1), np.column_stack((p, t_p)), s_c, p_c, track_len
+
+
+def range_variances(arrays, start, end, lags, threshold, shuffled, seed):
+    offsets = arrays['offsets'][start:end + 1]
+    pids = arrays['pid'][start:end]
+    track_ids = arrays['track_idx'][offsets[0]:offsets[-1]]
+    if shuffled:
+        track_ids = track_ids[shuffle_order(seed, pids, offsets)]
+    data, codes, present = FeatureMatrix(arrays['data'], arrays['tonality']).get_many(track_ids)
+    artists = arrays['artists'][track_ids] if threshold > 0 else None
+    s, p, s_c, p_c, track_len = batch_variances(offsets - offsets[0], data, codes, present, artists, lags, threshold)
+    arrays['sequential'][pids] = s
+    arrays['playlist'][pids] = p
+    arrays['s_c'][pids] = s_c
+    arrays['p_c'][pids] = p_c
+    arrays['track_len'][pids] = track_len
+    return start, end
+
+
+def shared_range_variances(task):
+    return range_variances(attached(), *task)
+
+
+class FeatureVariances(Mapping):
+    labels = list(AudioFeature.feature_labels)
+
+    def __init__(self, sequential, playlist, s_c, p_c, track_len, lags=(1,), lag=None):
+        self.sequential = sequential
+        self.playlist = playlist
+        self.s_c = s_c
+        self.p_c = p_c
+        self.track_len = track_len
+        self.lags = tuple(lags)
+        self.lag = self.lags[0] if lag is None else lag
+        self.column = self.lags.index(self.lag)
+
+    @classmethod
+    def empty(cls, n_pids, lags=(1,)):
+        return cls(np.full((n_pids, len(cls.labels), len(lags)), np.nan), np.full((n_pids, len(cls.labels)), np.nan),
+                   np.zeros((n_pids, len(lags)), dtype=np.int64), np.zeros(n_pids, dtype=np.int64),
+                   np.full(n_pids, -1, dtype=np.int64), lags)
+
+    @classmethod
+    def from_dict(cls, variances, lag=1):
+        result = cls.empty(max(variances, default=-1) + 1, (lag,))
+        for pid, (var_dict, s_c, p_c, track_len) in variances.items():
+            for i, label in enumerate(cls.labels):
+                result.sequential[pid, i, 0], result.playlist[pid, i] = var_dict[label]
+            result.s_c[pid, 0], result.p_c[pid], result.track_len[pid] = s_c, p_c, track_len
+        return result
+
+    def arrays(self):
+        return {'sequential': self.sequential, 'playlist': self.playlist, 's_c': self.s_c, 'p_c': self.p_c,
+                'track_len': self.track_len}
+
+    def get_rows(self, pids):
+        return tuple(array[pids] for array in self.arrays().values())
+
+    def set_rows(self, pids, rows):
+        for array, values in zip(self.arrays().values(), rows):
+            array[pids] = values
+
+    def at_lag(self, lag):
+        return FeatureVariances(self.sequential, self.playlist, self.s_c, self.p_c, self.track_len, self.lags, lag)
+
+    def __getitem__(self, pid):
+        if pid not in self:
+            raise KeyError(pid)
+        sequential = self.sequential[pid, :, self.column].tolist()
+        var_dict = dict(zip(self.labels, zip(sequential, self.playlist[pid].tolist())))
+        return var_dict, int(self.s_c[pid, self.column]), int(self.p_c[pid]), int(self.track_len[pid])
+
+    def __contains__(self, pid):
+        return isinstance(pid, (int, np.integer)) and 0 <= pid < len(self.track_len) and self.track_len[pid] >= 0
+
+    def __iter__(self):
+        return iter(np.flatnonzero(self.track_len >= 0).tolist())
+
+    def __len__(self):
+        return int(np.count_nonzero(self.track_len >= 0))
 
 
 class FeatureVarianceService(Service):
 
-    def __init__(self, distance=1, threshold=0.0, shuffled=False, seed=42, cached_path=CACHED_PATH):
+    def __init__(self, distance=1, threshold=0.0, shuffled=False, seed=42, cached_path=CACHED_PATH, mmap=False,
+                 lags=None):
         self.distance = distance
         self.threshold = threshold
-        self.variances = {}
+        self.lags = None if lags is None else tuple(lags)
+        self.variances = FeatureVariances.empty(0, self.get_lags())
         self.shuffled = shuffled
         self.seed = seed
-        if shuffled:
-            filepath = os.path.join(cached_path, f'feature_variances_{distance:02d}_{threshold:3.1f}_shuffled.pk')
+        if lags is None:
+            filename = f'feature_variances_{distance:02d}_{threshold:3.1f}'
         else:
-            filepath = os.path.join(cached_path, f'feature_variances_{distance:02d}_{threshold:3.1f}.pk')
-        super().__init__(filepath)
-
-    def _transform(self, playlist, feature_service: NormalizedFeatureService, track_info: TrackInfoService, random):
-        features = {label: [] for label in AudioFeature.feature_labels}
-        artists = []
-        tracks = playlist.tracks
-        if self.shuffled:
-            random.shuffle(tracks)
-
-        for track in tracks:
-            if track not in feature_service:
-                for lst in features.values():
-                    lst.append(None)
-            else:
-                feature = feature_service[track]
-                for label, lst in features.items():
-                    lst.append(feature[label])
-
-            if self.threshold > 0.0:
-                track_artists = {track.artist_id}
-                if track in track_info:
-                    track_artists.update(track_info[track.track_id].artist_ids)
-                artists.append(track_artists)
-            else:
-                artists.append(None)
-        return features, artists
-
-    def load_from_data(self, playlists, feature_service: NormalizedFeatureService, track_info: TrackInfoService = None):
-        random = Random(self.seed)
-        assert self.threshold == 0.0 and track_info is None
-        for i, batch in enumerate(batched(playlists, 10000)):
-            futures = []
-            with concurrent.futures.ProcessPoolExecutor(max_workers=48) as executor:
-                print(f"Starting {i}")
-                for playlist in batch:
-                    playlist_features, playlist_artists = self._transform(playlist, feature_service, track_info, random)
-                    future = executor.submit(features_to_variance, pid=playlist.playlist_id,
-                                             features=playlist_features, artists=playlist_artists,
-                                             distance=self.distance, threshold=self.threshold)
-                    futures.append(future)
-                print(f"Waiting {i}")
-                for f in futures:
-                    pid, variances, s_c, p_c, track_len = f.result()
-                    self.variances[pid] = variances, s_c, p_c, track_len
+            filename = f'feature_variances_lags_{"-".join(f"{lag:02d}" for lag in self.lags)}_{threshold:3.1f}'
+        if shuffled:
+            filename += '_shuffled'
+        super().__init__(os.path.join(cached_path, filename + '.pk'), mmap)
+
+    def get_lags(self):
+        return (self.distance,) if self.lags is None else self.lags
+
+    def _track_artists(self, track_artist_idx, track_info: TrackInfoService):
+        artist_sets = {track_id: sorted({int(track_artist_idx[track_id])} | info.artist_ids)
+                       for track_id, info in track_info.track_info.items() if track_id < len(track_artist_idx)}
+        width = max(map(len, artist_sets.values()), default=1)
+        artists = np.full((len(track_artist_idx), width), -1, dtype=np.int32)
+        artists[:, 0] = track_artist_idx
+        for track_id, artist_ids in artist_sets.items():
+            artists[track_id, :len(artist_ids)] = artist_ids
+        return artists
+
+    def load_from_data(self, playlist_service: PlaylistService, feature_service: NormalizedFeatureService,
+                       track_info: TrackInfoService = None, batch_size=BATCH_SIZE, max_workers=1, shared_path=None):
+        self.depends_on(playlist_service, feature_service, track_info)
+        assert self.threshold == 0.0 or track_info is not None
+        store = playlist_service.store
+        features = feature_service.features
+        if not isinstance(features, FeatureMatrix):
+            features = FeatureMatrix.from_dict(features, dtype=np.float64)
+        arrays = {'pid': store.pid, 'offsets': store.offsets, 'track_idx': store.track_idx, 'data': features.data,
+                  'tonality': features.tonality}
+        if self.threshold > 0.0:
+            arrays['artists'] = self._track_artists(playlist_service.track_service.artist_idx, track_info)
+
+        self.variances = FeatureVariances.empty(int(store.pid.max(initial=-1)) + 1, self.get_lags())
+        chunks = self._load_checkpoints()
+        for pids, *rows in chunks.values():
+            self.variances.set_rows(pids, rows)
+        tasks = [(start, min(start + batch_size, len(store)), self.get_lags(), self.threshold, self.shuffled,
+                  self.seed) for start in range(0, len(store), batch_size)]
+        tasks = [task for task in tasks if task[:2] not in chunks]
+        if max_workers <= 1:
+            arrays.update(self.variances.arrays())
+            for start, end, *params in tasks:
+                print(f'Starting {start}')
+                range_variances(arrays, start, end, *params)
+                pids = store.pid[start:end]
+                self._checkpoint(start, end, (pids, *self.variances.get_rows(pids)))
+            return
+
+        with shared_arrays(shared_path) as shared:
+            for name, array in arrays.items():
+                shared.put(name, array)
+            for name, array in self.variances.arrays().items():
+                shared.put(name, array, writable=True)
+            outputs = FeatureVariances(*(shared.get(name) for name in self.variances.arrays()), self.get_lags())
+            with concurrent.futures.ProcessPoolExecutor(max_workers, initializer=attach,
+                                                        initargs=(shared,)) as executor:
+                for start, end, *_ in executor.map(shared_range_variances, tasks):
+                    print(f'Finished {start}')
+                    pids = store.pid[start:end]
+                    rows = outputs.get_rows(pids)
+                    self.variances.set_rows(pids, rows)
+                    self._checkpoint(start, end, (pids, *rows))
 
     def save(self):
-        self._save(self.variances)
+        v = self.variances
+        self._save((v.sequential, v.playlist, v.s_c, v.p_c, v.track_len, v.lags))
 
     def load_from_cache(self):
-        self.variances = self._load_from_cache()
+        state = self._load_from_cache()
+        if isinstance(state, dict):
+            self.variances = FeatureVariances.from_dict(state, self.distance)
+        elif len(state) == 5:
+            sequential, playlist, s_c, p_c, track_len = state
+            self.variances = FeatureVariances(sequential[:, :, None], playlist, s_c[:, None], p_c, track_len,
+                                              (self.distance,))
+        else:
+            self.variances = FeatureVariances(*state)
 
 
-def save(shuffled=False):
+def save(shuffled=False, threshold=0.0, lags=None):
     playlist_service = PlaylistService()
     playlist_service.load_from_cache()
 
     feature_service = NormalizedFeatureService()
     feature_service.load_from_cache()
 
-    feature_analyser = FeatureVarianceService(shuffled=shuffled)
-    feature_analyser.load_from_data(playlist_service.playlists.values(), feature_service)
+    track_info = None
+    if threshold > 0.0:
+        track_info = TrackInfoService()
+        track_info.load_from_cache()
+
+    feature_analyser = FeatureVarianceService(threshold=threshold, shuffled=shuffled, lags=lags)
+    feature_analyser.load_from_data(playlist_service, feature_service, track_info,
+                                    max_workers=MAX_WORKERS if threshold > 0.0 else 1)
     feature_analyser.save()
     print('Finished')
 
@@ -0,0 +1,44 @@
+import os
+
+from ppo.track import Track
+from services import CACHED_PATH
+from services.service import Service
+from utils.interner import Interner
+
+
+class IdService(Service):
+    def __init__(self, cached_path=CACHED_PATH):
+        filepath = os.path.join(cached_path, 'id_service.pk')
+        self.tracks = Interner()
+        self.artists = Interner()
+        self.albums = Interner()
+        super().__init__(filepath)
+
+    def track_id(self, item):
+        if isinstance(item, Track):
+            item = item.track_id
+        if isinstance(item, str):
+            return self.tracks.get(item)
+        return item
+
+    def save(self):
+        self._save((self.tracks, self.artists, self.albums))
+
+    def load_from_cache(self):
+        self.tracks, self.artists, self.albums = self._load_from_cache()
+
+
+_id_services = {}
+
+
+def load_id_service(cached_path=CACHED_PATH):
+    if cached_path not in _id_services:
+        id_service = IdService(cached_path)
+        if id_service.is_cached():
+            id_service.load_from_cache()
+        _id_services[cached_path] = id_service
+    return _id_services[cached_path]
+
+
+def clear_id_services():
+    _id_services.clear()
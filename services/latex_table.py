@@ -1,11 +1,12 @@
 import numpy as np
-from scipy.stats import norm
 
 from services.causal_inference_service import CausalInferenceService
 from services.coherence_service import CoherenceService
 
 
 def add_matching(row, estimate, p_value):
+    from scipy.stats import norm
+
     z = estimate['ate'] / estimate['ate_se']
     if 2 * (1 - norm.cdf(np.abs(z))) > p_value:
         row.append(r'\color{gray} ' + f"{estimate['ate']:.3f}")
@@ -14,6 +15,8 @@ def add_matching(row, estimate, p_value):
 
 
 def add_p_value(row, estimate):
+    from scipy.stats import norm
+
     z = estimate['ate'] / estimate['ate_se']
     p_value = 2 * (1 - norm.cdf(np.abs(z)))
     formated = f"{p_value:.4f}".replace('0.', '.')
@@ -1,25 +1,43 @@
 import os
+from typing import Dict
 
 import numpy as np
 
+from ppo.audio_feature import AudioFeature
+from ppo.feature_matrix import FeatureMatrix
 from services import CACHED_PATH
 from services.feature_service import FeatureService
+from services.id_service import IdService, load_id_service
 from services.service import Service
 
 
 class NormalizedFeatureService(Service):
-    def __init__(self, cached_path=CACHED_PATH):
+    def __init__(self, cached_path=CACHED_PATH, id_service: IdService = None, mmap=False):
         filepath = os.path.join(cached_path, f'normalized_feature_service.pk')
-        self.features = dict()
-        super().__init__(filepath)
+        self.id_service = id_service if id_service is not None else load_id_service(cached_path)
+        self.features: Dict[int, AudioFeature] | FeatureMatrix = dict()
+        super().__init__(filepath, mmap)
 
     def load_from_data(self, feature_service: FeatureService):
+        self.depends_on(feature_service)
         data = feature_service.features
-        tempo = np.array([f['tempo'] for f in data.values()])
-
         min_loudness = -60
         diff_loudness = 60
 
+        if isinstance(data, FeatureMatrix):
+            present = data.tonality >= 0
+            tempo = data.column('tempo')
+            min_tempo = tempo[present].min()
+            diff_tempo = tempo[present].max() - min_tempo
+
+            loudness = data.column('loudness')
+            loudness[:] = ((np.clip(loudness, -60, 0) - min_loudness) / diff_loudness) ** 3
+            tempo[:] = (tempo - min_tempo) / diff_tempo
+            self.features = data
+            return
+
+        tempo = np.array([f['tempo'] for f in data.values()])
+
         min_tempo = tempo.min()
         diff_tempo = tempo.max() - min_tempo
 
@@ -36,11 +54,14 @@ class NormalizedFeatureService(Service):
     def load_from_cache(self):
         self.features = self._load_from_cache()
 
+    def get_many(self, items):
+        return FeatureMatrix.lookup(self.features, [self.id_service.track_id(item) for item in items])
+
     def __contains__(self, item):
-        return item in self.features
+        return self.id_service.track_id(item) in self.features
 
     def __getitem__(self, item):
-        return self.features[item]
+        return self.features[self.id_service.track_id(item)]
 
 
 def save():
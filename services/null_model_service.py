@@ -0,0 +1,123 @@
+import os
+
+import numpy as np
+
+from ppo.audio_feature import AudioFeature
+from ppo.feature_matrix import FeatureMatrix
+from services import CACHED_PATH
+from services.normalized_feature_service import NormalizedFeatureService
+from services.playlist_service import PlaylistService
+from services.service import Service
+from utils.permutation_util import feature_permutation_moments, tonality_permutation_moments, \
+    count_samples_below
+from utils.variance_util import batched_feature_variances, batched_tonality_variances
+
+BATCH_SIZE = 50_000
+
+
+class NullModelService(Service):
+    labels = list(AudioFeature.feature_labels)
+
+    def __init__(self, distance=1, n_samples=0, seed=42, cached_path=CACHED_PATH, mmap=False):
+        self.distance = distance
+        self.n_samples = n_samples
+        self.seed = seed
+        self.track_len = np.zeros(0, dtype=np.int64)
+        self.sequential = np.zeros((0, len(self.labels)))
+        self.playlist = np.zeros((0, len(self.labels)))
+        self.expected = np.zeros((0, len(self.labels)))
+        self.variance = np.zeros((0, len(self.labels)))
+        self.p_value = np.zeros((0, len(self.labels)))
+        self.sampled_p_value = np.zeros((0, len(self.labels)))
+        filename = f'null_model_{distance:02d}'
+        if n_samples:
+            filename += f'_{n_samples}'
+        super().__init__(os.path.join(cached_path, filename + '.pk'), mmap)
+
+    def load_from_data(self, playlist_service: PlaylistService, feature_service: NormalizedFeatureService,
+                       batch_size=BATCH_SIZE):
+        from scipy.special import ndtr
+
+        self.depends_on(playlist_service, feature_service)
+        store = playlist_service.store
+        features = feature_service.features
+        if not isinstance(features, FeatureMatrix):
+            features = FeatureMatrix.from_dict(features, dtype=np.float64)
+        random = np.random.default_rng(self.seed)
+
+        n_pids = int(store.pid.max(initial=-1)) + 1
+        self.track_len = np.full(n_pids, -1, dtype=np.int64)
+        for name in ['sequential', 'playlist', 'expected', 'variance', 'p_value', 'sampled_p_value']:
+            setattr(self, name, np.full((n_pids, len(self.labels)), np.nan))
+
+        for start in range(0, len(store), batch_size):
+            print(f'Starting {start}')
+            offsets = store.offsets[start:start + batch_size + 1]
+            data, codes, present = features.get_many(store.track_idx[offsets[0]:offsets[-1]])
+            rows = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+            track_len = np.bincount(rows[present], minlength=len(offsets) - 1)
+            offsets = np.concatenate(([0], np.cumsum(track_len)))
+            data, codes = data[present], codes[present]
+            lags = [self.distance]
+
+            s, p, _, _, _ = batched_feature_variances(offsets, data, np.ones(len(codes), dtype=bool), lags)
+            t_s, t_p, _, _, _ = batched_tonality_variances(offsets, codes, lags)
+            expected, variance = feature_permutation_moments(offsets, data, self.distance)
+            t_expected, t_variance = tonality_permutation_moments(offsets, codes, self.distance)
+            sequential = np.column_stack((s[:, :, 0], t_s[:, 0]))
+            variance = np.column_stack((variance, t_variance))
+            expected = np.column_stack((expected, t_expected))
+
+            pids = store.pid[start:start + batch_size]
+            self.track_len[pids] = track_len
+            self.sequential[pids] = sequential
+            self.playlist[pids] = np.column_stack((p, t_p))
+            self.expected[pids] = expected
+            self.variance[pids] = variance
+            with np.errstate(divide='ignore', invalid='ignore'):
+                self.p_value[pids] = np.where(variance > 0, ndtr((sequential - expected) / np.sqrt(variance)),
+                                              np.nan)
+            if self.n_samples:
+                counts = count_samples_below(offsets, data, codes, self.distance, sequential, self.n_samples, random)
+                self.sampled_p_value[pids] = (1 + counts) / (self.n_samples + 1)
+                self.sampled_p_value[pids[np.isnan(sequential).any(axis=1)]] = np.nan
+
+    def coherence(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return 1.0 - self.sequential / self.playlist
+
+    def coherence_std(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.sqrt(self.variance) / self.playlist
+
+    def save(self):
+        self._save((self.track_len, self.sequential, self.playlist, self.expected, self.variance, self.p_value,
+                    self.sampled_p_value))
+
+    def load_from_cache(self):
+        self.track_len, self.sequential, self.playlist, self.expected, self.variance, self.p_value, \
+            self.sampled_p_value = self._load_from_cache()
+
+
+def save(n_samples=0):
+    playlist_service = PlaylistService()
+    playlist_service.load_from_cache()
+
+    feature_service = NormalizedFeatureService()
+    feature_service.load_from_cache()
+
+    null_model_service = NullModelService(n_samples=n_samples)
+    null_model_service.load_from_data(playlist_service, feature_service)
+    null_model_service.save()
+    print('Finished')
+
+
+def load():
+    null_model_service = NullModelService()
+    null_model_service.load_from_cache()
+    print('Finished')
+
+
+if __name__ == '__main__':
+    # save()
+    load()
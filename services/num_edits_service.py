@@ -3,6 +3,7 @@ import os
 
 from services import CACHED_PATH
 from services.service import Service
+from utils.mpd_util import slice_files
 
 
 class NumEditsService(Service):
@@ -12,8 +13,7 @@ class NumEditsService(Service):
         super().__init__(filepath)
 
     def load_from_data(self, directory='data/mpd.v1'):
-        for filename in next(os.walk(directory))[2]:
-            filepath = os.path.join(directory, filename)
+        for filepath in slice_files(directory):
             data = json_reader.load(open(filepath))
             playlist_list = data['playlists']
 
@@ -1,63 +1,80 @@
-import json as json_reader
 import os
-from typing import Dict
+from contextlib import closing
+
+import numpy as np
 
 from ppo.playlist import Playlist
-from ppo.track import Track
+from ppo.playlist_store import PlaylistStore, PlaylistStoreBuilder, PlaylistMapping
 from services import CACHED_PATH
+from services.id_service import IdService, load_id_service
+from services.num_edits_service import NumEditsService
 from services.service import Service
 from services.track_service import TrackService
-from utils.bool_util import str_to_bool
+from utils import MAX_WORKERS
+from utils.mpd_util import slice_files, parse_slices
 
 
 class PlaylistService(Service):
-    def __init__(self, filtered=True, cached_path=CACHED_PATH):
+    def __init__(self, filtered=True, cached_path=CACHED_PATH, id_service: IdService = None, mmap=False):
         if filtered:
             filepath = os.path.join(cached_path, f'playlist_service_filtered.pk')
         else:
             filepath = os.path.join(cached_path, f'playlist_service_all.pk')
         self.size = 1_000_000
         self.filtered = filtered
-        self.playlists: Dict[str, Playlist] = {}
-        self.track_service: TrackService | None = None
-        super().__init__(filepath)
-
-    def load_from_data(self, directory='data/mpd.v1'):
-        self.track_service = TrackService()
-        for filename in next(os.walk(directory))[2]:
-            filepath = os.path.join(directory, filename)
-            data = json_reader.load(open(filepath))
-            playlist_list = data['playlists']
-
-            for json in playlist_list:
-                if len(self.playlists) >= self.size:
+        self.cached_path = cached_path
+        self.id_service = id_service if id_service is not None else load_id_service(cached_path)
+        self.store: PlaylistStore = PlaylistStoreBuilder().build()
+        self.track_service = TrackService(self.id_service)
+        super().__init__(filepath, mmap)
+
+    @property
+    def playlists(self):
+        return PlaylistMapping(self.store, self.track_service.track)
+
+    @property
+    def mask(self):
+        return self.store.mask
+
+    def load_from_data(self, directory='data/mpd.v1', num_edits_service: NumEditsService = None, max_workers=1):
+        self.track_service = TrackService(self.id_service)
+        builder = PlaylistStoreBuilder()
+        with closing(parse_slices(slice_files(directory), max_workers)) as slices:
+            self._add_slices(builder, slices, num_edits_service)
+        self.track_service.finish()
+        self.store = builder.build()
+
+    def _add_slices(self, builder: PlaylistStoreBuilder, slices, num_edits_service: NumEditsService):
+        for playlist_list in slices:
+            for row in playlist_list:
+                if len(builder) >= self.size:
                     return
-                playlist_id = json['pid']
-                title = json['name'].lower()
-                num_followers = json['num_followers']
-                nb_tracks = json['num_tracks']
-                is_collaborative = str_to_bool(json['collaborative'])
-                modified_at = json['modified_at']
-
-                tracks = []
-                for track_json in json['tracks']:
-                    track_id = track_json['track_uri'].split(':')[2]
-                    artist_id = track_json['artist_uri'].split(':')[2]
-                    album_id = track_json['album_uri'].split(':')[2]
-                    duration = track_json['duration_ms'] // 1000
-                    track = self.track_service.add_track(Track(track_id, artist_id, album_id, duration))
-                    tracks.append(track)
-
-                playlist = Playlist(playlist_id, title, nb_tracks, num_followers, is_collaborative, modified_at, tracks)
-                assert len(playlist.tracks) == nb_tracks
-                if not self.filtered or len(playlist.tracks) == len(playlist._tracks) <= 250:
-                    self.playlists[playlist_id] = playlist
+                playlist_id, title, nb_tracks, num_followers, is_collaborative, modified_at, num_edits, tracks = row
+
+                track_idx = [self.track_service.add(*track) for track in tracks]
+                assert len(track_idx) == nb_tracks
+                if num_edits_service is not None:
+                    num_edits_service.num_edits[playlist_id] = num_edits
+
+                mask = len(set(track_idx)) == len(track_idx) <= 250
+                if not self.filtered or mask:
+                    builder.append(playlist_id, title, nb_tracks, num_followers, is_collaborative, modified_at, mask,
+                                   track_idx)
+
+    def filtered_view(self):
+        playlist_service = PlaylistService(filtered=True, cached_path=self.cached_path, id_service=self.id_service,
+                                           mmap=self.mmap)
+        playlist_service.size = self.size
+        playlist_service.store = self.store.subset(np.flatnonzero(self.store.mask))
+        playlist_service.track_service = self.track_service
+        return playlist_service
 
     def save(self):
-        self._save((self.playlists, self.track_service))
+        self._save((self.store, self.track_service))
 
     def load_from_cache(self):
-        self.playlists, self.track_service = self._load_from_cache()
+        self.store, self.track_service = self._load_from_cache()
+        self.track_service.id_service = self.id_service
 
     def __contains__(self, item):
         if type(item) == Playlist:
@@ -73,13 +90,29 @@ class PlaylistService(Service):
             idx = item
         return self.playlists[idx]
 
+
 def save(filtered=True):
     playlist_service = PlaylistService(filtered=filtered)
     playlist_service.load_from_data()
     playlist_service.save()
+    playlist_service.id_service.save()
     print(f"saved {len(playlist_service.playlists)} playlists")
 
 
+def save_all(max_workers=MAX_WORKERS):
+    num_edits_service = NumEditsService()
+    playlist_service = PlaylistService(filtered=False)
+    playlist_service.load_from_data(num_edits_service=num_edits_service, max_workers=max_workers)
+    playlist_service.save()
+    playlist_service.id_service.save()
+    num_edits_service.save()
+    print(f"saved {len(playlist_service.playlists)} playlists")
+
+    filtered_service = playlist_service.filtered_view()
+    filtered_service.save()
+    print(f"saved {len(filtered_service.playlists)} filtered playlists")
+
+
 def load():
     playlist_service = PlaylistService()
     playlist_service.load_from_cache()
@@ -87,5 +120,5 @@ def load():
 
 
 if __name__ == '__main__':
-    # save()
+    # save_all()
     load()
@@ -1,6 +1,7 @@
-import math
 import os
 
+import numpy as np
+
 from services import CACHED_PATH
 from services.playlist_service import PlaylistService
 from services.service import Service
@@ -14,13 +15,11 @@ class PopularityService(Service):
         super().__init__(filepath)
 
     def load_from_data(self, playlist_service: PlaylistService):
-        counts = playlist_service.track_service.count
-        for pid, playlist in playlist_service.playlists.items():
-            popularity = 0
-            for track in playlist.tracks:
-                popularity += math.log(counts[track.track_id])
-            popularity /= len(playlist.tracks)
-            self.popularity[pid] = popularity
+        self.depends_on(playlist_service)
+        store = playlist_service.store
+        log_counts = np.log(np.maximum(playlist_service.track_service.count, 1))
+        popularity = store.segment_sum(log_counts[store.track_idx]) / store.lengths()
+        self.popularity = dict(zip(store.pid.tolist(), popularity.tolist()))
 
     def save(self):
         self._save(self.popularity)
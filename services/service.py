@@ -1,20 +1,191 @@
+import hashlib
+import json
 import os
 import pickle as pk
+import shutil
+
+import numpy as np
+
+MANIFEST = 'manifest.json'
+STATE = 'state.pk'
+CHECKPOINT = 'checkpoint.json'
+META_SUFFIX = '.meta.json'
+NON_PARAMS = {'filepath', 'mmap', 'cached_path', 'used_cached', 'upstream'}
+
+
+def is_param(value):
+    if isinstance(value, (list, tuple)):
+        return all(is_param(v) for v in value)
+    return value is None or isinstance(value, (bool, int, float, str))
+
+
+def file_hash(filepaths):
+    digest = hashlib.blake2b(digest_size=16)
+    for filepath in filepaths:
+        digest.update(os.path.basename(filepath).encode())
+        with open(filepath, 'rb') as file:
+            while chunk := file.read(1 << 24):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArrayPickler(pk.Pickler):
+    def __init__(self, file, directory):
+        super().__init__(file, pk.HIGHEST_PROTOCOL)
+        self.directory = directory
+        self.arrays = {}
+
+    def persistent_id(self, obj):
+        if type(obj) not in (np.ndarray, np.memmap) or obj.dtype.hasobject:
+            return None
+        name = f'array_{len(self.arrays):05d}.npy'
+        np.save(os.path.join(self.directory, name), obj)
+        self.arrays[name] = {'dtype': obj.dtype.str, 'shape': list(obj.shape)}
+        return name
+
+
+class ArrayUnpickler(pk.Unpickler):
+    def __init__(self, file, directory, mmap_mode):
+        super().__init__(file)
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+
+    def persistent_load(self, pid):
+        return np.load(os.path.join(self.directory, pid), mmap_mode=self.mmap_mode)
 
 
 class Service:
-    def __init__(self, filepath):
+    def __init__(self, filepath, mmap=False):
         self.filepath = filepath
+        self.mmap = mmap
+        self.upstream: list[Service] = []
+        self.param_names = [key for key, value in vars(self).items()
+                            if key not in NON_PARAMS and value is not None and is_param(value)]
+
+    @property
+    def array_path(self):
+        return os.path.splitext(self.filepath)[0]
+
+    @property
+    def meta_path(self):
+        return self.filepath + META_SUFFIX
+
+    @property
+    def checkpoint_path(self):
+        return self.array_path + '.checkpoints'
+
+    def depends_on(self, *services):
+        self.upstream = [service for service in services if service is not None]
+        return self
+
+    def params(self):
+        return {key: getattr(self, key) for key in sorted(self.param_names)}
+
+    def fingerprint(self):
+        upstream = {f'{type(service).__name__}:{os.path.basename(service.filepath)}': service.content_hash()
+                    for service in self.upstream}
+        payload = json.dumps({'service': type(self).__name__, 'params': self.params(), 'upstream': upstream},
+                             sort_keys=True)
+        return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+    def _read_meta(self):
+        if not os.path.exists(self.meta_path):
+            return None
+        with open(self.meta_path) as file:
+            return json.load(file)
+
+    def _write_meta(self):
+        if os.path.exists(os.path.join(self.array_path, MANIFEST)) and self.mmap:
+            files = sorted(os.path.join(self.array_path, file) for file in os.listdir(self.array_path))
+        else:
+            files = [self.filepath]
+        meta = {'fingerprint': self.fingerprint(), 'params': self.params(), 'content_hash': file_hash(files),
+                'upstream': {os.path.basename(service.filepath): service.content_hash() for service in self.upstream}}
+        with open(self.meta_path + '.tmp', 'w') as file:
+            json.dump(meta, file, indent=1)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+
+    def content_hash(self):
+        meta = self._read_meta()
+        return None if meta is None else meta['content_hash']
+
+    def _exists(self):
+        return os.path.exists(self.filepath) or os.path.exists(os.path.join(self.array_path, MANIFEST))
+
+    def is_stale(self):
+        meta = self._read_meta()
+        if meta is None:
+            return len(self.upstream) > 0
+        return meta['fingerprint'] != self.fingerprint()
 
     def is_cached(self):
-        return os.path.exists(self.filepath)
+        return self._exists() and not self.is_stale()
 
     def _save(self, data):
-        pk.dump(data, open(self.filepath, 'wb'), pk.HIGHEST_PROTOCOL)
+        if self.mmap:
+            self._save_arrays(data)
+        else:
+            with open(self.filepath + '.tmp', 'wb') as file:
+                pk.dump(data, file, pk.HIGHEST_PROTOCOL)
+            os.replace(self.filepath + '.tmp', self.filepath)
+        self._write_meta()
+        self._clear_checkpoints()
 
     def _load_from_cache(self):
+        if os.path.exists(os.path.join(self.array_path, MANIFEST)) and (self.mmap or not os.path.exists(self.filepath)):
+            return self._load_arrays()
         return pk.load(open(self.filepath, 'rb'))
 
+    def _load_checkpoints(self):
+        meta_path = os.path.join(self.checkpoint_path, CHECKPOINT)
+        fingerprint = self.fingerprint()
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                if json.load(file)['fingerprint'] == fingerprint:
+                    return self._read_chunks()
+        self._clear_checkpoints()
+        os.makedirs(self.checkpoint_path)
+        with open(meta_path + '.tmp', 'w') as file:
+            json.dump({'fingerprint': fingerprint, 'params': self.params()}, file, indent=1)
+        os.replace(meta_path + '.tmp', meta_path)
+        return {}
+
+    def _read_chunks(self):
+        chunks = {}
+        for name in sorted(os.listdir(self.checkpoint_path)):
+            if name.startswith('chunk_') and name.endswith('.pk'):
+                _, start, end = os.path.splitext(name)[0].split('_')
+                with open(os.path.join(self.checkpoint_path, name), 'rb') as file:
+                    chunks[int(start), int(end)] = pk.load(file)
+        return chunks
+
+    def _checkpoint(self, start, end, data):
+        filepath = os.path.join(self.checkpoint_path, f'chunk_{start:09d}_{end:09d}.pk')
+        with open(filepath + '.tmp', 'wb') as file:
+            pk.dump(data, file, pk.HIGHEST_PROTOCOL)
+        os.replace(filepath + '.tmp', filepath)
+
+    def _clear_checkpoints(self):
+        shutil.rmtree(self.checkpoint_path, ignore_errors=True)
+
+    def _save_arrays(self, data):
+        tmp_path = self.array_path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        with open(os.path.join(tmp_path, STATE), 'wb') as file:
+            pickler = ArrayPickler(file, tmp_path)
+            pickler.dump(data)
+        with open(os.path.join(tmp_path, MANIFEST), 'w') as file:
+            json.dump({'state': STATE, 'arrays': pickler.arrays}, file, indent=1)
+        shutil.rmtree(self.array_path, ignore_errors=True)
+        os.rename(tmp_path, self.array_path)
+
+    def _load_arrays(self, mmap_mode='c'):
+        with open(os.path.join(self.array_path, MANIFEST)) as file:
+            manifest = json.load(file)
+        with open(os.path.join(self.array_path, manifest['state']), 'rb') as file:
+            return ArrayUnpickler(file, self.array_path, mmap_mode).load()
+
     def save(self):
         raise NotImplementedError()
 
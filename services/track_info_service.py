@@ -1,35 +1,78 @@
 import csv
 import os
 import re
+from collections import Counter
+from typing import Dict
+
+import numpy as np
+from more_itertools import batched
 
 from ppo.track_info import TrackInfo
 from services import CACHED_PATH
+from services.id_service import IdService, load_id_service
 from services.service import Service
+from utils import MAX_WORKERS
 from utils.bool_util import str_to_bool
+from utils.pool_util import ordered_map
+
+
+CHUNK_SIZE = 100_000
+
+
+def read_track_info(filepath, chunksize=CHUNK_SIZE):
+    import pandas as pd
+
+    rows = []
+    rejected = Counter()
+    with open(filepath) as file:
+        for lines in batched(csv.reader(file, delimiter='\t'), chunksize):
+            complete = [line for line in lines if len(line) >= 7]
+            rejected['missing fields'] += len(lines) - len(complete)
+            if not complete:
+                continue
+
+            columns = list(zip(*(line[:7] for line in complete)))
+            duration = pd.to_numeric(pd.Series(columns[3]), errors='coerce').to_numpy()
+            popularity_strings = np.array(columns[6], dtype=object)
+            no_popularity = popularity_strings == 'None'
+            popularity = pd.to_numeric(pd.Series(popularity_strings), errors='coerce').to_numpy()
+
+            bad_duration = np.isnan(duration) | (duration != np.floor(duration))
+            bad_popularity = ~no_popularity & (np.isnan(popularity) | (popularity != np.floor(popularity)))
+            rejected['malformed duration'] += int(np.count_nonzero(bad_duration))
+            rejected['malformed popularity'] += int(np.count_nonzero(bad_popularity & ~bad_duration))
+            accepted = ~(bad_duration | bad_popularity)
+
+            explicit = [str_to_bool(value) for value in columns[4]]
+            is_local = [str_to_bool(value) for value in columns[5]]
+            for i in np.flatnonzero(accepted).tolist():
+                line = complete[i]
+                rows.append((line[0], line[1], line[2], int(duration[i]), explicit[i], is_local[i],
+                             None if no_popularity[i] else int(popularity[i]), line[7:]))
+    return rows, +rejected
 
 
 class TrackInfoService(Service):
-    def __init__(self, cached_path=CACHED_PATH):
+    def __init__(self, cached_path=CACHED_PATH, id_service: IdService = None):
         filepath = os.path.join(cached_path, f'track_info_service.pk')
-        self.track_info = dict()
+        self.id_service = id_service if id_service is not None else load_id_service(cached_path)
+        self.track_info: Dict[int, TrackInfo] = dict()
+        self.rejected = Counter()
         super().__init__(filepath)
 
-    def load_from_data(self, directory='data/tracks'):
-        for file in next(os.walk(directory))[2]:
-            if not re.match(r'tracks_\d{3}.csv', file):
-                continue
-            reader = csv.reader(open(os.path.join(directory, file)), delimiter='\t')
-            for line in reader:
-                track_id = line[0]
-                name = line[1]
-                album = line[2]
-                duration = int(line[3])
-
-                explicit = str_to_bool(line[4])
-                is_local = str_to_bool(line[5])
-                popularity = None if line[6] == 'None' else int(line[6])
+    def load_from_data(self, directory='data/tracks', max_workers=1):
+        files = sorted(os.path.join(directory, file) for file in next(os.walk(directory))[2]
+                       if re.match(r'tracks_\d{3}.csv', file))
+        self.rejected = Counter()
+        for rows, rejected in ordered_map(read_track_info, files, max_workers):
+            self.rejected.update(rejected)
+            for track_id, name, album, duration, explicit, is_local, popularity, artists in rows:
+                track_id = self.id_service.tracks.intern(track_id)
+                artist_ids = {self.id_service.artists.intern(artist) for artist in artists}
                 self.track_info[track_id] = TrackInfo(track_id, name, album, duration, explicit, is_local, popularity,
-                                                      set(line[7:]))
+                                                      artist_ids)
+        if self.rejected:
+            print(f'Rejected track rows: {dict(self.rejected)}')
 
     def save(self):
         self._save(self.track_info)
@@ -38,16 +81,17 @@ class TrackInfoService(Service):
         self.track_info = self._load_from_cache()
 
     def __contains__(self, item):
-        return item in self.track_info
+        return self.id_service.track_id(item) in self.track_info
 
     def __getitem__(self, item):
-        return self.track_info[item]
+        return self.track_info[self.id_service.track_id(item)]
 
 
-def save():
+def save(max_workers=MAX_WORKERS):
     track_info_service = TrackInfoService()
-    track_info_service.load_from_data()
+    track_info_service.load_from_data(max_workers=max_workers)
     track_info_service.save()
+    track_info_service.id_service.save()
     print('Finished')
 
 
@@ -1,26 +1,67 @@
-from typing import Dict
-
-from typeguard import typechecked
-
+import numpy as np
 from ppo.track import Track
+from services.id_service import IdService
+from utils.typecheck_util import typechecked
 
 
 class TrackService:
 
-    def __init__(self):
-        self.tracks: Dict[str, Track] = {}
-        self.count: Dict[str, int] = {}
+    def __init__(self, id_service: IdService):
+        self.id_service = id_service
+        self.count = np.zeros(0, dtype=np.int64)
+        self.artist_idx = np.zeros(0, dtype=np.int32)
+        self.album_idx = np.zeros(0, dtype=np.int32)
+        self.duration = np.zeros(0, dtype=np.int32)
+        self._columns = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['id_service'] = None
+        return state
 
     @typechecked
     def add_track(self, track: Track):
-        track_id = track.track_id
-        if track_id in self.tracks:
-            self.count[track_id] += 1
-            track = self.tracks[track_id]
+        return self.track(self.add(track.track_id, track.artist_id, track.album_id, track.duration))
+
+    def add(self, track_id: str, artist_id: str, album_id: str, duration: int):
+        if self._columns is None:
+            self._columns = self.count.tolist(), self.artist_idx.tolist(), self.album_idx.tolist(), \
+                self.duration.tolist()
+        count, artist_idx, album_idx, durations = self._columns
+
+        idx = self.id_service.tracks.intern(track_id)
+        if idx >= len(count):
+            missing = idx + 1 - len(count)
+            count.extend([0] * missing)
+            artist_idx.extend([-1] * missing)
+            album_idx.extend([-1] * missing)
+            durations.extend([0] * missing)
+        if count[idx] == 0:
+            artist_idx[idx] = self.id_service.artists.intern(artist_id)
+            album_idx[idx] = self.id_service.albums.intern(album_id)
+            durations[idx] = duration
+        count[idx] += 1
+        return idx
+
+    def finish(self):
+        if self._columns is not None:
+            count, artist_idx, album_idx, durations = self._columns
+            self.count = np.array(count, dtype=np.int64)
+            self.artist_idx = np.array(artist_idx, dtype=np.int32)
+            self.album_idx = np.array(album_idx, dtype=np.int32)
+            self.duration = np.array(durations, dtype=np.int32)
+            self._columns = None
+
+    def track(self, idx):
+        if self._columns is None:
+            artist_idx, album_idx, durations = self.artist_idx, self.album_idx, self.duration
         else:
-            self.tracks[track_id] = track
-            self.count[track_id] = 1
-        return track
+            _, artist_idx, album_idx, durations = self._columns
+        return Track(self.id_service.tracks[idx], self.id_service.artists[artist_idx[idx]],
+                     self.id_service.albums[album_idx[idx]], int(durations[idx]))
+
+    def __len__(self):
+        return int(np.count_nonzero(self.count))
 
     def get_popularity(self, track: Track):
-        return self.count[track.track_id]
+        return int(self.count[self.id_service.track_id(track)])
@@ -1,2 +1,5 @@
 import multiprocessing
-MAX_WORKERS = multiprocessing.cpu_count()
\ No newline at end of file
+import os
+
+MAX_WORKERS = multiprocessing.cpu_count()
+TYPECHECK = os.environ.get('PLCOH_TYPECHECK', '1') != '0'
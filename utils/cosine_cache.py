@@ -0,0 +1,65 @@
+import math
+
+import numpy as np
+
+
+def normalize_columns(columns):
+    from scipy.sparse import diags
+
+    columns = columns.astype(np.float64)
+    norms = np.sqrt(np.asarray(columns.multiply(columns).sum(axis=0)).ravel())
+    return (columns @ diags(1 / np.where(norms > 0, norms, 1))).tocsc()
+
+
+def cosine_distances(a, b):
+    return np.clip(1 - (a.T @ b).toarray(), 0, 2)
+
+
+class CosineDistanceCache:
+    def __init__(self, index, hot):
+        self.index = index
+        self.hot = hot
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def top_k(cls, matrix, counts, k, max_bytes, block_size=4096):
+        k = min(k, len(counts), math.isqrt(max_bytes // np.dtype(np.float32).itemsize))
+        hot_ids = np.argsort(-np.asarray(counts), kind='stable')[:k]
+        index = np.full(len(counts), -1, dtype=np.int32)
+        index[hot_ids] = np.arange(k, dtype=np.int32)
+
+        columns = normalize_columns(matrix[:, hot_ids])
+        hot = np.empty((k, k), dtype=np.float32)
+        for start in range(0, k, block_size):
+            hot[start:start + block_size] = cosine_distances(columns[:, start:start + block_size], columns)
+        return cls(index, hot)
+
+    def distances(self, artist_ids, columns):
+        n = len(artist_ids)
+        positions = self.index[artist_ids]
+        hot = positions >= 0
+        distances = np.empty((n, n))
+        distances[np.ix_(hot, hot)] = self.hot[np.ix_(positions[hot], positions[hot])]
+        n_hot = int(np.count_nonzero(hot))
+        self.hits += n_hot ** 2
+        self.misses += n ** 2 - n_hot ** 2
+
+        cold = np.flatnonzero(~hot)
+        if len(cold):
+            columns = normalize_columns(columns)
+            block = cosine_distances(columns[:, cold], columns)
+            distances[cold] = block
+            distances[:, cold] = block.T
+        return distances
+
+    def counters(self):
+        return np.array([self.hits, self.misses], dtype=np.int64)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': hit_rate(self.counters())}
+
+
+def hit_rate(counters):
+    hits, misses = np.asarray(counters).tolist()
+    return hits / (hits + misses) if hits + misses else float('nan')
@@ -0,0 +1,37 @@
+import numpy as np
+
+
+class Interner:
+    def __init__(self):
+        self.keys: list[str] = []
+        self.ids: dict[str, int] = {}
+
+    def intern(self, key: str):
+        idx = self.ids.get(key)
+        if idx is None:
+            idx = len(self.keys)
+            self.ids[key] = idx
+            self.keys.append(key)
+        return idx
+
+    def get(self, key: str, default=-1):
+        return self.ids.get(key, default)
+
+    def lookup(self, keys):
+        return np.fromiter((self.ids.get(key, -1) for key in keys), dtype=np.int32)
+
+    def __getstate__(self):
+        return self.keys
+
+    def __setstate__(self, keys):
+        self.keys = keys
+        self.ids = {key: idx for idx, key in enumerate(keys)}
+
+    def __contains__(self, key):
+        return key in self.ids
+
+    def __getitem__(self, idx):
+        return self.keys[idx]
+
+    def __len__(self):
+        return len(self.keys)
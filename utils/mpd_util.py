@@ -0,0 +1,29 @@
+import json as json_reader
+import os
+import re
+
+from utils.bool_util import str_to_bool
+from utils.pool_util import ordered_map
+
+
+def slice_files(directory):
+    files = [file for file in next(os.walk(directory))[2] if re.match(r'mpd\.slice\.\d+-\d+\.json', file)]
+    files.sort(key=lambda file: int(re.match(r'mpd\.slice\.(\d+)', file).group(1)))
+    return [os.path.join(directory, file) for file in files]
+
+
+def parse_slice(filepath):
+    data = json_reader.load(open(filepath))
+    playlists = []
+    for json in data['playlists']:
+        tracks = [(track_json['track_uri'].split(':')[2],
+                   track_json['artist_uri'].split(':')[2],
+                   track_json['album_uri'].split(':')[2],
+                   track_json['duration_ms'] // 1000) for track_json in json['tracks']]
+        playlists.append((json['pid'], json['name'].lower(), json['num_tracks'], json['num_followers'],
+                          str_to_bool(json['collaborative']), json['modified_at'], int(json['num_edits']), tracks))
+    return playlists
+
+
+def parse_slices(files, max_workers=1):
+    return ordered_map(parse_slice, files, max_workers)
@@ -0,0 +1,79 @@
+import numpy as np
+
+from utils.tonality_distances import tonality_squared_distances
+from utils.variance_util import segment_sums, lag_pairs
+
+
+def permutation_moments(n, pair_sums, quartic_sums, triple_sums, d):
+    n = np.asarray(n, dtype=np.float64)
+    m = np.maximum(n - d, 0)
+    overlaps = 2 * np.maximum(m - d, 0)
+    others = m * (m - 1) - overlaps
+    quadruple_sums = pair_sums ** 2 - 2 * quartic_sums - 4 * triple_sums
+
+    def mean(sums, k):
+        count = np.ones_like(n)
+        for i in range(k):
+            count = count * (n - i)
+        return np.where(n >= k, sums / np.maximum(count, 1), 0.0)
+
+    a, b = mean(pair_sums, 2), mean(quartic_sums, 2)
+    c, e = mean(triple_sums, 3), mean(quadruple_sums, 4)
+    variance = np.maximum(m * (b - a ** 2) + overlaps * (c - a ** 2) + others * (e - a ** 2), 0)
+    expected = np.where(m > 0, a / 2, np.nan)
+    return expected, np.where(m > 0, variance / np.maximum(2 * m, 1) ** 2, np.nan)
+
+
+def feature_permutation_moments(offsets, values, d):
+    values = np.asarray(values, dtype=np.float64)
+    lengths = np.diff(offsets)
+    n_rows = len(lengths)
+    rows = np.repeat(np.arange(n_rows), lengths)
+    n = lengths.astype(np.float64)[:, None]
+
+    means = segment_sums(rows, values, n_rows) / np.maximum(n, 1)
+    centered = values - means[rows]
+    p2 = segment_sums(rows, np.square(centered), n_rows)
+    p4 = segment_sums(rows, np.square(np.square(centered)), n_rows)
+    pair_sums = 2 * n * p2
+    quartic_sums = 2 * n * p4 + 6 * p2 ** 2
+    triple_sums = n ** 2 * p4 + 3 * n * p2 ** 2 - quartic_sums
+    return permutation_moments(n, pair_sums, quartic_sums, triple_sums, d)
+
+
+def tonality_permutation_moments(offsets, codes, d):
+    codes = np.asarray(codes, dtype=np.int64)
+    lengths = np.diff(offsets)
+    n_rows = len(lengths)
+    size = len(tonality_squared_distances)
+    rows = np.repeat(np.arange(n_rows), lengths)
+
+    counts = np.bincount(rows * size + codes, minlength=n_rows * size).reshape(n_rows, size).astype(np.float64)
+    weighted = counts @ tonality_squared_distances
+    pair_sums = np.einsum('ri,ri->r', weighted, counts)
+    quartic_sums = np.einsum('ri,ri->r', counts @ tonality_squared_distances ** 2, counts)
+    triple_sums = np.einsum('ri,ri->r', counts, weighted ** 2) - quartic_sums
+    return permutation_moments(lengths, pair_sums, quartic_sums, triple_sums, d)
+
+
+def count_samples_below(offsets, values, codes, d, observed, n_samples, random, chunk_entries=1 << 24):
+    values = np.asarray(values, dtype=np.float64)
+    codes = np.asarray(codes, dtype=np.int64)
+    lengths = np.diff(offsets)
+    n_rows = len(lengths)
+    n_entries = len(codes)
+    rows = np.repeat(np.arange(n_rows), lengths)
+    idx = lag_pairs(rows, np.ones(n_entries, dtype=bool), d)
+    counter = np.bincount(rows[idx], minlength=n_rows)
+
+    counts = np.zeros((n_rows, values.shape[1] + 1), dtype=np.int64)
+    chunk = max(1, chunk_entries // max(n_entries, 1))
+    for start in range(0, n_samples, chunk):
+        size = min(chunk, n_samples - start)
+        order = np.argsort(rows + random.random((size, n_entries)), axis=1)
+        a, b = order[:, idx].ravel(), order[:, idx + d].ravel()
+        squares = np.column_stack((np.square(values[b] - values[a]), tonality_squared_distances[codes[a], codes[b]]))
+        sample_rows = (np.arange(size)[:, None] * n_rows + rows[idx]).ravel()
+        sums = segment_sums(sample_rows, squares, size * n_rows).reshape(size, n_rows, -1)
+        counts += (sums / np.maximum(counter, 1)[:, None] / 2 <= observed).sum(axis=0)
+    return counts
@@ -0,0 +1,21 @@
+import concurrent.futures
+from collections import deque
+from itertools import islice
+
+
+def ordered_map(function, items, max_workers=1):
+    if max_workers <= 1:
+        yield from map(function, items)
+        return
+
+    items = iter(items)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = deque(executor.submit(function, item) for item in islice(items, 2 * max_workers))
+        try:
+            while futures:
+                result = futures.popleft().result()
+                futures.extend(executor.submit(function, item) for item in islice(items, 1))
+                yield result
+        finally:
+            for future in futures:
+                future.cancel()
@@ -0,0 +1,41 @@
+import os
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+
+_attached = {}
+
+
+class SharedArrays:
+    def __init__(self, directory):
+        self.directory = directory
+        self.modes = {}
+
+    def path(self, name):
+        return os.path.join(self.directory, name + '.npy')
+
+    def put(self, name, array, writable=False):
+        np.save(self.path(name), np.ascontiguousarray(array))
+        self.modes[name] = 'r+' if writable else 'r'
+
+    def get(self, name):
+        return np.load(self.path(name), mmap_mode=self.modes[name])
+
+    def open(self):
+        return {name: self.get(name) for name in self.modes}
+
+
+@contextmanager
+def shared_arrays(directory=None):
+    with tempfile.TemporaryDirectory(prefix='plcoh_', dir=directory) as tmp_path:
+        yield SharedArrays(tmp_path)
+
+
+def attach(shared: SharedArrays):
+    _attached.clear()
+    _attached.update(shared.open())
+
+
+def attached():
+    return _attached
@@ -0,0 +1,28 @@
+import numpy as np
+
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def splitmix64(x):
+    x = np.asarray(x, dtype=np.uint64) + GOLDEN_GAMMA
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def shuffle_keys(seed, pids, positions):
+    seed = splitmix64(np.array([seed], dtype=np.uint64))
+    playlist_keys = splitmix64(np.asarray(pids, dtype=np.uint64) ^ seed)
+    return splitmix64(playlist_keys ^ np.asarray(positions, dtype=np.uint64))
+
+
+def playlist_order(seed, pid, n):
+    return np.argsort(shuffle_keys(seed, np.full(n, pid), np.arange(n)), kind='stable')
+
+
+def shuffle_order(seed, pids, offsets):
+    offsets = np.asarray(offsets, dtype=np.int64) - offsets[0]
+    lengths = np.diff(offsets)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.arange(offsets[-1]) - offsets[rows]
+    return np.lexsort((shuffle_keys(seed, np.asarray(pids)[rows], positions), rows))
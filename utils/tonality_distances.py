@@ -123,3 +123,4 @@ tonality_distances = np.array([[0.0, 1.9318516525781366, 0.9999999999999999, 1.4
                                 1.126032500610494, 1.5059711791502262, 1.9318516525781366, 0.9999999999999999,
                                 1.414213562373095, 1.7320508075688772, 0.5176380902050415, 2.0, 0.5176380902050415,
                                 1.7320508075688772, 1.414213562373095, 0.9999999999999999, 1.9318516525781366, 0.0]])
+tonality_squared_distances = tonality_distances ** 2
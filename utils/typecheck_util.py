@@ -0,0 +1,8 @@
+from utils import TYPECHECK
+
+
+def typechecked(function):
+    if not TYPECHECK:
+        return function
+    from typeguard import typechecked as typeguard_typechecked
+    return typeguard_typechecked(function)
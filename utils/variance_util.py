@@ -1,4 +1,6 @@
-from utils.tonality_distances import tonality_distances
+import numpy as np
+
+from utils.tonality_distances import tonality_distances, tonality_squared_distances
 
 
 def get_coherence(sq_var, pl_var, threshold):
@@ -66,3 +68,154 @@ def calc_variances(data, distance, threshold, f=pair_distance):
     s, s_c = sequential_variance(tracks, distance, threshold, f=f)
     p, p_c = playlist_variance(tracks, threshold, f=f)
     return pid, s, p, s_c, p_c, len(tracks)
+
+
+def playlist_variances(values, present):
+    values = np.asarray(values, dtype=np.float64)[present]
+    n = len(values)
+    if n < 2:
+        return np.full(values.shape[1:], np.nan), 0
+    return values.var(axis=0, ddof=1), n * (n - 1) // 2
+
+
+def sequential_variances(values, present, d):
+    values = np.asarray(values, dtype=np.float64)
+    if d >= len(values):
+        return np.full(values.shape[1:], np.nan), 0
+    both = present[:-d] & present[d:]
+    counter = int(np.count_nonzero(both))
+    if counter == 0:
+        return np.full(values.shape[1:], np.nan), 0
+    differences = values[d:][both] - values[:-d][both]
+    return np.square(differences).sum(axis=0) / counter / 2, counter
+
+
+def calc_feature_variances(values, present, distance):
+    s, s_c = sequential_variances(values, present, distance)
+    p, p_c = playlist_variances(values, present)
+    return s, p, s_c, p_c, len(values)
+
+
+def tonality_variances(codes, d):
+    codes = np.asarray(codes, dtype=np.int64)
+    present = codes >= 0
+    n = int(np.count_nonzero(present))
+    counts = np.bincount(codes[present], minlength=len(tonality_squared_distances)).astype(np.float64)
+    p_c = n * (n - 1) // 2
+    p = counts @ tonality_squared_distances @ counts / 2 / p_c / 2 if p_c > 0 else float('NaN')
+
+    s, s_c = float('NaN'), 0
+    if d < len(codes):
+        both = present[:-d] & present[d:]
+        s_c = int(np.count_nonzero(both))
+        if s_c > 0:
+            s = tonality_squared_distances[codes[:-d][both], codes[d:][both]].sum() / s_c / 2
+    return float(s), float(p), s_c, p_c, len(codes)
+
+
+def segment_sums(rows, values, n_rows):
+    return np.stack([np.bincount(rows, weights=values[:, i], minlength=n_rows) for i in range(values.shape[1])],
+                    axis=1).reshape(n_rows, values.shape[1])
+
+
+def lag_pairs(rows, present, d):
+    if d >= len(rows):
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero((rows[:-d] == rows[d:]) & present[:-d] & present[d:])
+
+
+def batched_feature_variances(offsets, values, present, lags):
+    values = np.asarray(values, dtype=np.float64)
+    lengths = np.diff(offsets)
+    n_rows = len(lengths)
+    rows = np.repeat(np.arange(n_rows), lengths)
+
+    kept_rows, kept = rows[present], values[present]
+    n = np.bincount(kept_rows, minlength=n_rows)
+    p_c = n * (n - 1) // 2
+    means = segment_sums(kept_rows, kept, n_rows) / np.maximum(n, 1)[:, None]
+    squares = segment_sums(kept_rows, np.square(kept - means[kept_rows]), n_rows)
+    p = np.where((n > 1)[:, None], squares / np.maximum(n - 1, 1)[:, None], np.nan)
+
+    s = np.full((n_rows, values.shape[1], len(lags)), np.nan)
+    s_c = np.zeros((n_rows, len(lags)), dtype=np.int64)
+    for column, d in enumerate(lags):
+        idx = lag_pairs(rows, present, d)
+        counter = np.bincount(rows[idx], minlength=n_rows)
+        sums = segment_sums(rows[idx], np.square(values[idx + d] - values[idx]), n_rows)
+        s[:, :, column] = np.where((counter > 0)[:, None], sums / np.maximum(counter, 1)[:, None] / 2, np.nan)
+        s_c[:, column] = counter
+    return s, p, s_c, p_c, lengths
+
+
+def batched_tonality_variances(offsets, codes, lags):
+    codes = np.asarray(codes, dtype=np.int64)
+    lengths = np.diff(offsets)
+    n_rows = len(lengths)
+    size = len(tonality_squared_distances)
+    rows = np.repeat(np.arange(n_rows), lengths)
+    present = codes >= 0
+
+    counts = np.bincount(rows[present] * size + codes[present], minlength=n_rows * size)
+    counts = counts.reshape(n_rows, size).astype(np.float64)
+    n = counts.sum(axis=1).astype(np.int64)
+    p_c = n * (n - 1) // 2
+    pair_sums = np.einsum('ri,ri->r', counts @ tonality_squared_distances, counts) / 2
+    p = np.where(p_c > 0, pair_sums / np.maximum(p_c, 1) / 2, np.nan)
+
+    s = np.full((n_rows, len(lags)), np.nan)
+    s_c = np.zeros((n_rows, len(lags)), dtype=np.int64)
+    for column, d in enumerate(lags):
+        idx = lag_pairs(rows, present, d)
+        counter = np.bincount(rows[idx], minlength=n_rows)
+        sums = np.bincount(rows[idx], weights=tonality_squared_distances[codes[idx], codes[idx + d]],
+                           minlength=n_rows)
+        s[:, column] = np.where(counter > 0, sums / np.maximum(counter, 1) / 2, np.nan)
+        s_c[:, column] = counter
+    return s, p, s_c, p_c, lengths
+
+
+def artist_jaccard_distances(artists):
+    valid = artists >= 0
+    _, columns = np.unique(artists[valid], return_inverse=True)
+    membership = np.zeros((len(artists), int(columns.max(initial=-1)) + 1))
+    membership[np.nonzero(valid)[0], columns] = 1
+    intersection = membership @ membership.T
+    sizes = valid.sum(axis=1)
+    union = sizes[:, None] + sizes[None, :] - intersection
+    return 1 - intersection / np.maximum(union, 1)
+
+
+def thresholded_variances(values, codes, artists, lags, threshold):
+    values = np.asarray(values, dtype=np.float64)
+    codes = np.asarray(codes, dtype=np.int64)
+    n = len(codes)
+    present = (codes >= 0) & (artists >= 0).any(axis=1)
+    distances = artist_jaccard_distances(artists)
+
+    def variances(i, j):
+        keep = present[i] & present[j] & (distances[i, j] >= threshold)
+        i, j = i[keep], j[keep]
+        if len(i) == 0:
+            return np.full(values.shape[1] + 1, np.nan), 0
+        sums = np.append(np.square(values[j] - values[i]).sum(axis=0),
+                         tonality_squared_distances[codes[i], codes[j]].sum())
+        return sums / len(i) / 2, len(i)
+
+    sequential = [variances(np.arange(max(n - d, 0)), np.arange(d, max(n, d))) for d in lags]
+    s = np.stack([variance for variance, _ in sequential], axis=-1)
+    s_c = np.array([counter for _, counter in sequential], dtype=np.int64)
+    p, p_c = variances(*np.triu_indices(n, 1))
+    return s, p, s_c, p_c, n
+
+
+def batched_thresholded_variances(offsets, values, codes, artists, lags, threshold):
+    n_rows = len(offsets) - 1
+    s = np.full((n_rows, values.shape[1] + 1, len(lags)), np.nan)
+    p = np.full((n_rows, values.shape[1] + 1), np.nan)
+    s_c = np.zeros((n_rows, len(lags)), dtype=np.int64)
+    p_c = np.zeros(n_rows, dtype=np.int64)
+    for row, (start, end) in enumerate(zip(offsets[:-1].tolist(), offsets[1:].tolist())):
+        s[row], p[row], s_c[row], p_c[row], _ = thresholded_variances(values[start:end], codes[start:end],
+                                                                      artists[start:end], lags, threshold)
+    return s, p, s_c, p_c, np.diff(offsets)